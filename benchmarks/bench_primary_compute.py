@@ -0,0 +1,206 @@
+import argparse
+import csv
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_OUT_DIR = ROOT_DIR / "benchmarks" / "results"
+DEFAULT_BASELINE = ROOT_DIR / "benchmarks" / "baseline.json"
+CSV_FIELDS = [
+    "iterations",
+    "workers",
+    "kernel",
+    "schedule",
+    "processes",
+    "best_s",
+    "median_s",
+    "iters_per_s",
+    "parallel_efficiency",
+    "peak_rss_parent_mb",
+    "peak_rss_worker_mb",
+    "checksum",
+    "baseline_iters_per_s",
+    "regression",
+]
+
+
+def _csv_list(value: str, cast: type = str) -> list[Any]:
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS. For RUSAGE_CHILDREN it is the
+    # largest single reaped child, not a sum, and live workers are not counted.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss / scale, 1)
+
+
+def _run_single(config: dict[str, Any], repeats: int) -> dict[str, Any]:
+    sys.path.insert(0, str(ROOT_DIR))
+    import primary_compute
+
+    payload = {
+        "iterations": config["iterations"],
+        "workers": config["workers"],
+        "kernel": config["kernel"],
+        "schedule": config["schedule"],
+    }
+    durations = []
+    result: dict[str, Any] = {}
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = primary_compute.do_heavy_stuff(payload)
+        durations.append(time.perf_counter() - started)
+
+    # The pool outlives do_heavy_stuff; reap its workers so RUSAGE_CHILDREN sees them.
+    primary_compute._shutdown_pool()
+    durations.sort()
+    return {
+        **config,
+        "processes": result.get("processes", config["workers"]),
+        "best_s": round(durations[0], 4),
+        "median_s": round(durations[len(durations) // 2], 4),
+        "checksum": result["checksum"],
+        "peak_rss_parent_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+        "peak_rss_worker_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _run_isolated(config: dict[str, Any], repeats: int) -> dict[str, Any]:
+    # One interpreter per configuration keeps peak RSS and pool warm-up per config.
+    proc = subprocess.run(
+        [sys.executable, __file__, "--single", json.dumps(config), "--repeats", str(repeats)],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=ROOT_DIR,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _config_key(row: dict[str, Any]) -> str:
+    return f"{row['iterations']}/{row['workers']}/{row['kernel']}/{row['schedule']}"
+
+
+def _annotate(rows: list[dict[str, Any]], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    serial: dict[tuple[int, str, str], float] = {}
+    for row in rows:
+        row["iters_per_s"] = round(row["iterations"] / row["best_s"]) if row["best_s"] else None
+        if row["workers"] == 1:
+            serial[(row["iterations"], row["kernel"], row["schedule"])] = row["best_s"]
+
+    regressions = []
+    for row in rows:
+        base_s = serial.get((row["iterations"], row["kernel"], row["schedule"]))
+        row["parallel_efficiency"] = (
+            round(base_s / (row["best_s"] * row["processes"]), 3) if base_s and row["best_s"] else None
+        )
+
+        previous = baseline.get(_config_key(row))
+        row["baseline_iters_per_s"] = previous
+        row["regression"] = bool(
+            previous and row["iters_per_s"] is not None and row["iters_per_s"] < previous * (1.0 - tolerance)
+        )
+        if row["regression"]:
+            regressions.append(
+                f"{_config_key(row)}: {row['iters_per_s']} iters/s vs baseline {previous} "
+                f"({row['iters_per_s'] / previous - 1.0:+.1%})"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark primary_compute.do_heavy_stuff in local mode.")
+    parser.add_argument("--iterations", default="2000000,8000000")
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4, 6)))
+    parser.add_argument("--kernels", default="python,numpy")
+    parser.add_argument("--schedules", default="static,dynamic")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out-dir", default=str(DEFAULT_OUT_DIR))
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(_run_single(json.loads(args.single), max(1, args.repeats))))
+        return 0
+
+    sys.path.insert(0, str(ROOT_DIR))
+    import primary_compute
+
+    kernels = []
+    for kernel in _csv_list(args.kernels):
+        try:
+            kernels.append(primary_compute._resolve_kernel(kernel))
+        except RuntimeError as err:
+            print(f"skip kernel={kernel}: {err}", file=sys.stderr)
+
+    rows = []
+    sweep = itertools.product(
+        _csv_list(args.iterations, int),
+        _csv_list(args.workers, int),
+        kernels,
+        _csv_list(args.schedules),
+    )
+    for iterations, workers, kernel, schedule in sweep:
+        config = {"iterations": iterations, "workers": workers, "kernel": kernel, "schedule": schedule}
+        row = _run_isolated(config, max(1, args.repeats))
+        rows.append(row)
+        rate = f"{row['iterations'] / row['best_s']:,.0f}" if row["best_s"] else "n/a"
+        print(
+            f"{_config_key(row):<40} best={row['best_s']:.3f}s "
+            f"{rate} iters/s rss={row['peak_rss_parent_mb']}MiB worker_rss={row['peak_rss_worker_mb']}MiB",
+            flush=True,
+        )
+
+    baseline_path = Path(args.baseline)
+    baseline: dict[str, Any] = {}
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8")).get("iters_per_s", {})
+    regressions = _annotate(rows, baseline, args.tolerance)
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"platform": sys.platform, "cpu_count": os.cpu_count()},
+        "results": rows,
+        "regressions": regressions,
+    }
+    json_path = out_dir / f"bench-{stamp}.json"
+    json_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    csv_path = out_dir / f"bench-{stamp}.csv"
+    with csv_path.open("w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Wrote {json_path} and {csv_path}")
+
+    if args.save_baseline:
+        baseline_path.write_text(
+            json.dumps(
+                {"created_at": report["created_at"], "iters_per_s": {_config_key(row): row["iters_per_s"] for row in rows}},
+                indent=2,
+                sort_keys=True,
+            ),
+            encoding="utf-8",
+        )
+        print(f"Saved baseline to {baseline_path}")
+
+    for line in regressions:
+        print(f"REGRESSION {line}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,15 +1,38 @@
 import base64
 import hashlib
+import io
+import itertools
+import json
+import mmap
 import os
+import platform
 import posixpath
+import queue
+import selectors
 import shutil
 import stat
 import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator
 
 import modal
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 APP_NAME = os.getenv("MODAL_APP_NAME", "modal-task-runner")
 REPO_PATH = "/root/repo"
 DEFAULT_CMD = os.getenv("MODAL_DEFAULT_CMD", "echo modal-ready")
@@ -17,6 +40,57 @@ CPU = float(os.getenv("MODAL_CPU", "6"))
 MEMORY_MB = int(os.getenv("MODAL_MEMORY_MB", str(14 * 1024)))
 TIMEOUT_SECONDS = int(os.getenv("MODAL_TIMEOUT_SECONDS", str(60 * 60)))
 SYNC_MAX_BYTES = int(os.getenv("MODAL_SYNC_MAX_BYTES", str(50 * 1024 * 1024)))
+SNAPSHOT_MODE = os.getenv("MODAL_SNAPSHOT_MODE", "stat").strip().lower()
+DIGEST_ALGO = os.getenv("MODAL_DIGEST_ALGO", "auto").strip().lower()
+HASH_WORKERS = int(os.getenv("MODAL_HASH_WORKERS", str(max(1, int(CPU)))))
+MMAP_MIN_BYTES = int(os.getenv("MODAL_MMAP_MIN_BYTES", str(8 * 1024 * 1024)))
+SYNC_TRANSPORT = os.getenv("MODAL_SYNC_TRANSPORT", "stream").strip().lower()
+SYNC_CHUNK_BYTES = int(os.getenv("MODAL_SYNC_CHUNK_BYTES", str(4 * 1024 * 1024)))
+SYNC_COMPRESS_LEVEL = int(os.getenv("MODAL_SYNC_COMPRESS_LEVEL", "3"))
+SYNC_DELTA = os.getenv("MODAL_SYNC_DELTA", "1").strip().lower() not in {"0", "false", "no"}
+DELTA_MIN_BYTES = int(os.getenv("MODAL_DELTA_MIN_BYTES", str(4 * 1024 * 1024)))
+DELTA_BLOCK_BYTES = int(os.getenv("MODAL_DELTA_BLOCK_BYTES", str(64 * 1024)))
+DELTA_MAX_LITERAL_RATIO = float(os.getenv("MODAL_DELTA_MAX_LITERAL_RATIO", "0.5"))
+REPO_SYNC = os.getenv("MODAL_REPO_SYNC", "image").strip().lower()
+REPO_VOLUME_NAME = os.getenv("MODAL_REPO_VOLUME", f"{APP_NAME}-repo-blobs")
+REPO_MANIFEST_PATH = os.getenv("MODAL_REPO_MANIFEST", os.path.join(".caches", "modal_repo_manifest.json"))
+REPO_BLOB_MOUNT = "/repo-blobs"
+SESSION_IDLE_SECONDS = int(os.getenv("MODAL_SESSION_IDLE_SECONDS", "600"))
+OUTPUT_CHUNK_BYTES = int(os.getenv("MODAL_OUTPUT_CHUNK_BYTES", str(64 * 1024)))
+DEP_CACHE = os.getenv("MODAL_DEP_CACHE", "1").strip().lower() not in {"0", "false", "no"}
+DEP_CACHE_VOLUME_NAME = os.getenv("MODAL_DEP_CACHE_VOLUME", f"{APP_NAME}-dep-cache")
+DEP_CACHE_MOUNT = "/dep-cache"
+DEP_CACHE_MAX_BYTES = int(float(os.getenv("MODAL_DEP_CACHE_MAX_GB", "20")) * 1024 * 1024 * 1024)
+DEP_CACHE_EVICT_INTERVAL_S = int(os.getenv("MODAL_DEP_CACHE_EVICT_INTERVAL_S", "3600"))
+NODE_MODULES_CACHE = os.getenv("MODAL_NODE_MODULES_CACHE", "0").strip().lower() not in {"0", "false", "no"}
+NODE_LOCKFILES = ("package-lock.json", "yarn.lock", "pnpm-lock.yaml")
+PACKAGE_CACHE_DIRS = {
+    "npm_config_cache": "npm",
+    "YARN_CACHE_FOLDER": "yarn",
+    "PIP_CACHE_DIR": "pip",
+    "UV_CACHE_DIR": "uv",
+}
+# Containers do not inherit the local environment, so settings read on the container
+# side are baked into the image when they are set locally.
+CONTAINER_ENV_KEYS = (
+    "MODAL_CPU",
+    "MODAL_SNAPSHOT_MODE",
+    "MODAL_DIGEST_ALGO",
+    "MODAL_HASH_WORKERS",
+    "MODAL_MMAP_MIN_BYTES",
+    "MODAL_SYNC_MAX_BYTES",
+    "MODAL_OUTPUT_CHUNK_BYTES",
+    "MODAL_SYNC_CHUNK_BYTES",
+    "MODAL_SYNC_COMPRESS_LEVEL",
+    "MODAL_SYNC_DELTA",
+    "MODAL_DELTA_MIN_BYTES",
+    "MODAL_DELTA_BLOCK_BYTES",
+    "MODAL_DELTA_MAX_LITERAL_RATIO",
+    "MODAL_DEP_CACHE",
+    "MODAL_DEP_CACHE_MAX_GB",
+    "MODAL_DEP_CACHE_EVICT_INTERVAL_S",
+    "MODAL_NODE_MODULES_CACHE",
+)
 
 apt_packages = [
     pkg.strip()
@@ -41,7 +115,10 @@ def _ignore_local_path(path: Path) -> bool:
         ".mypy_cache",
         ".ruff_cache",
         ".venv",
+        ".caches",
     }
+    if NODE_MODULES_CACHE:
+        ignored_parts.add("node_modules")
     return any(part in ignored_parts for part in path.parts) or path.name in {".DS_Store"}
 
 
@@ -50,15 +127,88 @@ if apt_packages:
     image = image.apt_install(*apt_packages)
 if pip_packages:
     image = image.pip_install(*pip_packages)
-image = image.add_local_dir(".", remote_path=REPO_PATH, ignore=_ignore_local_path)
+container_env = {key: os.environ[key] for key in CONTAINER_ENV_KEYS if key in os.environ}
+if container_env:
+    image = image.env(container_env)
+if REPO_SYNC != "volume":
+    image = image.add_local_dir(".", remote_path=REPO_PATH, ignore=_ignore_local_path)
+
+repo_volume = modal.Volume.from_name(REPO_VOLUME_NAME, create_if_missing=True)
+dep_cache_volume = modal.Volume.from_name(DEP_CACHE_VOLUME_NAME, create_if_missing=True)
+function_volumes: dict[str, Any] = {}
+if REPO_SYNC == "volume":
+    function_volumes[REPO_BLOB_MOUNT] = repo_volume
+if DEP_CACHE:
+    function_volumes[DEP_CACHE_MOUNT] = dep_cache_volume
 
 
 def _relative_repo_path(path: str) -> str:
     return path.replace(os.sep, "/")
 
 
-def _snapshot_repo(root: str) -> dict[str, dict[str, Any]]:
+def _new_hasher(algo: str | None = None) -> Any:
+    algo = algo or DIGEST_ALGO
+    if algo == "auto":
+        algo = "xxhash" if xxhash is not None else "blake2b"
+    if algo == "xxhash":
+        if xxhash is None:
+            raise RuntimeError("MODAL_DIGEST_ALGO=xxhash requires the xxhash package.")
+        return xxhash.xxh3_128()
+    if algo == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    if algo == "sha256":
+        return hashlib.sha256()
+    raise ValueError("MODAL_DIGEST_ALGO must be one of: auto, xxhash, blake2b, sha256")
+
+
+def _hash_file(abs_path: str, size: int, algo: str | None = None) -> str:
+    hasher = _new_hasher(algo)
+    with open(abs_path, "rb") as fh:
+        if size >= MMAP_MIN_BYTES:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+        else:
+            hasher.update(fh.read())
+    return hasher.hexdigest()
+
+
+def _stat_key(st: os.stat_result) -> tuple[int, int, int, int]:
+    return (st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode)
+
+
+def _hash_files(files: list[tuple[str, int]], algo: str | None = None) -> list[str]:
+    # File reads and hashing of large buffers release the GIL, so threads scale with
+    # cores; files are handed out in batches to keep per-task overhead off tiny files.
+    if HASH_WORKERS > 1 and len(files) > 1:
+        batch_size = max(1, -(-len(files) // (HASH_WORKERS * 8)))
+        batches = [files[i : i + batch_size] for i in range(0, len(files), batch_size)]
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            return [
+                digest
+                for batch_digests in pool.map(
+                    lambda batch: [_hash_file(abs_path, size, algo) for abs_path, size in batch],
+                    batches,
+                )
+                for digest in batch_digests
+            ]
+    return [_hash_file(abs_path, size, algo) for abs_path, size in files]
+
+
+def _snapshot_repo(root: str, stat_index: dict[str, Any] | None = None) -> dict[str, dict[str, Any]]:
+    # With a stat_index, the first pass only records stat keys (digest None) and the
+    # next pass hashes just the files whose stat changed, so unchanged files compare
+    # equal without being read. Files modified at or after the first pass started are
+    # always rehashed, since a same-size rewrite within one mtime tick looks unchanged.
+    previous = None
+    if stat_index is not None:
+        if "files" in stat_index:
+            previous = stat_index
+        else:
+            stat_index["taken_ns"] = time.time_ns()
+            stat_index["files"] = {}
+
     snapshot: dict[str, dict[str, Any]] = {}
+    pending: list[tuple[str, str, int, int]] = []
     for dirpath, dirnames, filenames in os.walk(root, topdown=True):
         dirnames[:] = [name for name in dirnames if name != ".git"]
         for filename in filenames:
@@ -69,7 +219,9 @@ def _snapshot_repo(root: str) -> dict[str, dict[str, Any]]:
 
             if stat.S_ISLNK(st.st_mode):
                 target = os.readlink(abs_path)
-                digest = hashlib.sha256(f"symlink:{target}".encode("utf-8")).hexdigest()
+                hasher = _new_hasher()
+                hasher.update(f"symlink:{target}".encode("utf-8"))
+                digest = hasher.hexdigest()
                 snapshot[rel_path] = {
                     "kind": "symlink",
                     "digest": digest,
@@ -81,21 +233,146 @@ def _snapshot_repo(root: str) -> dict[str, dict[str, Any]]:
             if not stat.S_ISREG(st.st_mode):
                 continue
 
-            hasher = hashlib.sha256()
-            with open(abs_path, "rb") as fh:
-                for chunk in iter(lambda: fh.read(1024 * 1024), b""):
-                    hasher.update(chunk)
+            if stat_index is not None:
+                if previous is None:
+                    stat_index["files"][rel_path] = _stat_key(st)
+                    snapshot[rel_path] = {"kind": "file", "digest": None, "mode": mode}
+                    continue
+                if (
+                    previous["files"].get(rel_path) == _stat_key(st)
+                    and st.st_mtime_ns < previous["taken_ns"]
+                ):
+                    snapshot[rel_path] = {"kind": "file", "digest": None, "mode": mode}
+                    continue
 
-            snapshot[rel_path] = {
-                "kind": "file",
-                "digest": hasher.hexdigest(),
-                "mode": mode,
-            }
+            pending.append((rel_path, abs_path, st.st_size, mode))
+
+    digests = _hash_files([(abs_path, size) for _, abs_path, size, _ in pending])
+    for (rel_path, _, _, mode), digest in zip(pending, digests):
+        snapshot[rel_path] = {
+            "kind": "file",
+            "digest": digest,
+            "mode": mode,
+        }
     return snapshot
 
 
-def _collect_repo_changes(root: str, before: dict[str, dict[str, Any]]) -> dict[str, Any]:
-    after = _snapshot_repo(root)
+# Block signatures are kept per container with the stat key they were taken at; warm
+# containers (a session serves every command from one) only re-read large files that
+# changed since the previous call.
+_SIGNATURE_CACHE: dict[str, tuple[tuple[int, int, int, int], int, dict[str, Any]]] = {}
+
+
+def _file_signature(abs_path: str) -> dict[str, Any]:
+    file_hasher = hashlib.blake2b(digest_size=32)
+    blocks: dict[bytes, int] = {}
+    with open(abs_path, "rb") as fh:
+        for index, block in enumerate(iter(lambda: fh.read(DELTA_BLOCK_BYTES), b"")):
+            file_hasher.update(block)
+            blocks.setdefault(hashlib.blake2b(block, digest_size=16).digest(), index)
+    return {"digest": file_hasher.hexdigest(), "blocks": blocks}
+
+
+def _delta_signatures(root: str, snapshot: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    # Block digests of large files as they were before the command, so a modified file
+    # can be sent as copy/insert operations against the unchanged local copy. As in
+    # _snapshot_repo, a file modified after its signature was started is signed again.
+    signatures: dict[str, dict[str, Any]] = {}
+    pending: list[tuple[str, str, tuple[int, int, int, int]]] = []
+    for rel_path, entry in snapshot.items():
+        if entry["kind"] != "file":
+            continue
+        abs_path = os.path.join(root, rel_path.replace("/", os.sep))
+        st = os.lstat(abs_path)
+        if st.st_size < DELTA_MIN_BYTES:
+            continue
+        key = _stat_key(st)
+        cached = _SIGNATURE_CACHE.get(rel_path)
+        if cached is not None and cached[0] == key and st.st_mtime_ns < cached[1]:
+            signatures[rel_path] = cached[2]
+            continue
+        pending.append((rel_path, abs_path, key))
+
+    signed_ns = time.time_ns()
+    if HASH_WORKERS > 1 and len(pending) > 1:
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            computed = list(pool.map(_file_signature, [abs_path for _, abs_path, _ in pending]))
+    else:
+        computed = [_file_signature(abs_path) for _, abs_path, _ in pending]
+    for (rel_path, _, key), signature in zip(pending, computed):
+        _SIGNATURE_CACHE[rel_path] = (key, signed_ns, signature)
+        signatures[rel_path] = signature
+    for rel_path in set(_SIGNATURE_CACHE) - set(signatures):
+        del _SIGNATURE_CACHE[rel_path]
+    return signatures
+
+
+def _file_delta(abs_path: str, signature: dict[str, Any]) -> dict[str, Any] | None:
+    # Fixed-size blocks are matched by strong digest; that covers appends and in-place
+    # rewrites, which is what large-file edits here look like. A byte-wise rolling
+    # search would cost more in Python than shipping the bytes. Literal ops name a
+    # byte range of the new file; the bytes are read again when they are sent (see
+    # _delta_literals), so a large rewrite is never held in memory.
+    ops: list[dict[str, Any]] = []
+    literal_bytes = 0
+    size = 0
+    file_hasher = hashlib.blake2b(digest_size=32)
+
+    with open(abs_path, "rb") as fh:
+        for block in iter(lambda: fh.read(DELTA_BLOCK_BYTES), b""):
+            block_offset = size
+            size += len(block)
+            file_hasher.update(block)
+            index = signature["blocks"].get(hashlib.blake2b(block, digest_size=16).digest())
+            if index is None:
+                literal_bytes += len(block)
+                if ops and "literal" in ops[-1]:
+                    ops[-1]["literal"][1] += len(block)
+                else:
+                    ops.append({"literal": [block_offset, len(block)]})
+                continue
+
+            offset = index * DELTA_BLOCK_BYTES
+            if ops and "copy" in ops[-1] and sum(ops[-1]["copy"]) == offset:
+                ops[-1]["copy"][1] += len(block)
+            else:
+                ops.append({"copy": [offset, len(block)]})
+
+    if literal_bytes > size * DELTA_MAX_LITERAL_RATIO:
+        return None
+    return {
+        "base_digest": signature["digest"],
+        "digest": file_hasher.hexdigest(),
+        "size": size,
+        "literal_bytes": literal_bytes,
+        "ops": ops,
+    }
+
+
+def _delta_literals(abs_path: str, ops: list[dict[str, Any]]) -> Iterator[bytes]:
+    # Yields the literal bytes of a delta in op order, at most SYNC_CHUNK_BYTES at a
+    # time. A file rewritten since _file_delta fails the digest check when applied.
+    with open(abs_path, "rb") as fh:
+        for op in ops:
+            if "literal" not in op:
+                continue
+            offset, remaining = op["literal"]
+            fh.seek(offset)
+            while remaining > 0:
+                data = fh.read(min(SYNC_CHUNK_BYTES, remaining))
+                if not data:
+                    raise RuntimeError(f"{abs_path} shrank while it was being synced back.")
+                remaining -= len(data)
+                yield data
+
+
+def _collect_repo_changes(
+    root: str,
+    before: dict[str, dict[str, Any]],
+    stat_index: dict[str, Any] | None = None,
+    signatures: dict[str, dict[str, Any]] | None = None,
+) -> dict[str, Any]:
+    after = _snapshot_repo(root, stat_index)
     removed = sorted(set(before.keys()) - set(after.keys()))
 
     updated: list[dict[str, Any]] = []
@@ -112,6 +389,28 @@ def _collect_repo_changes(root: str, before: dict[str, dict[str, Any]]) -> dict[
             updated.append({"path": rel_path, "kind": "symlink", "target": current["target"]})
             continue
 
+        delta = None
+        if signatures and rel_path in signatures and previous and previous["kind"] == "file":
+            delta = _file_delta(abs_path, signatures[rel_path])
+        if delta is not None:
+            payload_bytes += delta["literal_bytes"]
+            if payload_bytes > SYNC_MAX_BYTES:
+                raise RuntimeError(
+                    "sync_back payload exceeded MODAL_SYNC_MAX_BYTES "
+                    f"({SYNC_MAX_BYTES} bytes)."
+                )
+            literals = b"".join(_delta_literals(abs_path, delta["ops"]))
+            updated.append(
+                {
+                    "path": rel_path,
+                    "kind": "delta",
+                    "mode": current["mode"],
+                    **delta,
+                    "literals_b64": base64.b64encode(literals).decode("ascii"),
+                }
+            )
+            continue
+
         with open(abs_path, "rb") as fh:
             content = fh.read()
         payload_bytes += len(content)
@@ -141,8 +440,8 @@ def _validate_rel_path(rel_path: str) -> None:
         raise ValueError(f"Unsafe path: {rel_path!r}")
 
 
-def _apply_repo_changes(local_root: str, changes: dict[str, Any]) -> None:
-    for rel_path in changes.get("removed", []):
+def _remove_local_paths(local_root: str, removed: list[str]) -> None:
+    for rel_path in removed:
         _validate_rel_path(rel_path)
         abs_path = os.path.join(local_root, rel_path.replace("/", os.sep))
         if os.path.islink(abs_path) or os.path.isfile(abs_path):
@@ -151,19 +450,96 @@ def _apply_repo_changes(local_root: str, changes: dict[str, Any]) -> None:
         if os.path.isdir(abs_path):
             shutil.rmtree(abs_path)
 
+
+def _prepare_local_path(local_root: str, rel_path: str) -> str:
+    _validate_rel_path(rel_path)
+    abs_path = os.path.join(local_root, rel_path.replace("/", os.sep))
+    parent = os.path.dirname(abs_path)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+
+    if os.path.lexists(abs_path):
+        if os.path.isdir(abs_path) and not os.path.islink(abs_path):
+            shutil.rmtree(abs_path)
+        else:
+            os.remove(abs_path)
+    return abs_path
+
+
+def _apply_delta(local_root: str, item: dict[str, Any], literals: Iterator[bytes]) -> None:
+    # literals yields the bytes of the item's literal ops, in order and in chunks of
+    # any size; exactly that many bytes are consumed from it.
+    rel_path = item["path"]
+    _validate_rel_path(rel_path)
+    abs_path = os.path.join(local_root, rel_path.replace("/", os.sep))
+
+    try:
+        base = open(abs_path, "rb")
+    except OSError as err:
+        raise RuntimeError(
+            f"Cannot apply the synced-back delta for {rel_path}: the local file the remote "
+            f"command started from is missing or unreadable ({err.strerror}); "
+            "re-run with MODAL_SYNC_DELTA=0 to fetch it in full."
+        ) from err
+
+    pending = memoryview(b"")
+
+    def take(length: int) -> Iterator[memoryview]:
+        nonlocal pending
+        while length > 0:
+            if not pending:
+                pending = memoryview(next(literals, b""))
+                if not pending:
+                    raise RuntimeError(f"Delta literals for {rel_path} ended early.")
+            piece = pending[:length]
+            pending = pending[len(piece) :]
+            length -= len(piece)
+            yield piece
+
+    tmp_path = f"{abs_path}.modal-delta.tmp"
+    try:
+        with base:
+            base_hasher = hashlib.blake2b(digest_size=32)
+            for chunk in iter(lambda: base.read(1024 * 1024), b""):
+                base_hasher.update(chunk)
+            if base_hasher.hexdigest() != item["base_digest"]:
+                raise RuntimeError(
+                    f"Local {rel_path} differs from the copy the remote command started from; "
+                    "re-run with MODAL_SYNC_DELTA=0 to fetch it in full."
+                )
+
+            new_hasher = hashlib.blake2b(digest_size=32)
+            with open(tmp_path, "wb") as out:
+                for op in item["ops"]:
+                    if "copy" in op:
+                        offset, length = op["copy"]
+                        base.seek(offset)
+                        pieces: Any = [base.read(length)]
+                    else:
+                        pieces = take(op["literal"][1])
+                    for data in pieces:
+                        new_hasher.update(data)
+                        out.write(data)
+        if pending:
+            raise RuntimeError(f"Delta literals for {rel_path} are longer than its ops.")
+        if new_hasher.hexdigest() != item["digest"]:
+            raise RuntimeError(f"Delta reconstruction of {rel_path} failed digest verification.")
+        os.chmod(tmp_path, int(item["mode"]))
+        os.replace(tmp_path, abs_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _apply_repo_changes(local_root: str, changes: dict[str, Any]) -> None:
+    _remove_local_paths(local_root, changes.get("removed", []))
+
     for item in changes.get("updated", []):
-        rel_path = item["path"]
-        _validate_rel_path(rel_path)
-        abs_path = os.path.join(local_root, rel_path.replace("/", os.sep))
-        parent = os.path.dirname(abs_path)
-        if parent:
-            os.makedirs(parent, exist_ok=True)
+        if item["kind"] == "delta":
+            _apply_delta(local_root, item, iter([base64.b64decode(item["literals_b64"].encode("ascii"))]))
+            continue
 
-        if os.path.lexists(abs_path):
-            if os.path.isdir(abs_path) and not os.path.islink(abs_path):
-                shutil.rmtree(abs_path)
-            else:
-                os.remove(abs_path)
+        abs_path = _prepare_local_path(local_root, item["path"])
 
         if item["kind"] == "symlink":
             os.symlink(item["target"], abs_path)
@@ -175,33 +551,986 @@ def _apply_repo_changes(local_root: str, changes: dict[str, Any]) -> None:
         os.chmod(abs_path, int(item["mode"]))
 
 
-@app.function(image=image, cpu=CPU, memory=MEMORY_MB, timeout=TIMEOUT_SECONDS)
-def run_cmd(cmd: str, workdir: str = REPO_PATH) -> None:
-    env = os.environ.copy()
-    env["IN_MODAL_TASK_RUNNER"] = "1"
-    subprocess.run(["bash", "-lc", cmd], check=True, cwd=workdir, env=env)
+def _local_sync_codecs() -> list[str]:
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def _compressor(codec: str) -> Any:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=SYNC_COMPRESS_LEVEL).compressobj()
+    return zlib.compressobj(SYNC_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+
+
+def _decompressor(codec: str) -> Any:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Remote sent zstd sync data but zstandard is not installed locally.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def _stream_repo_changes(
+    root: str,
+    before: dict[str, dict[str, Any]],
+    stat_index: dict[str, Any] | None,
+    codecs: list[str],
+    signatures: dict[str, dict[str, Any]] | None = None,
+) -> Any:
+    # Frames: ("header", {...}) once, ("delta", item) per delta-encoded file followed
+    # by ("literal", bytes) chunks of its literal ops, then ("data", bytes) chunks of a
+    # compressed tar holding every other changed file.
+    # The tar is written member by member so no file is ever held in memory whole.
+    after = _snapshot_repo(root, stat_index)
+    removed = sorted(set(before.keys()) - set(after.keys()))
+    changed = [rel_path for rel_path in sorted(after.keys()) if before.get(rel_path) != after[rel_path]]
+
+    deltas: list[dict[str, Any]] = []
+    updated: list[str] = []
+    for rel_path in changed:
+        delta = None
+        previous = before.get(rel_path)
+        if signatures and rel_path in signatures and previous and after[rel_path]["kind"] == "file":
+            delta = _file_delta(os.path.join(root, rel_path.replace("/", os.sep)), signatures[rel_path])
+        if delta is None:
+            updated.append(rel_path)
+        else:
+            deltas.append({"path": rel_path, "kind": "delta", "mode": after[rel_path]["mode"], **delta})
+
+    available = {"gzip"} | ({"zstd"} if zstandard is not None else set())
+    codec = next((name for name in codecs if name in available), "gzip")
+    yield ("header", {"removed": removed, "updated": len(updated), "deltas": len(deltas), "codec": codec})
+    for item in deltas:
+        yield ("delta", item)
+        for data in _delta_literals(os.path.join(root, item["path"].replace("/", os.sep)), item["ops"]):
+            yield ("literal", data)
+
+    compressor = _compressor(codec)
+    pending: list[bytes] = []
+    pending_bytes = 0
+
+    def feed(data: bytes) -> bytes | None:
+        nonlocal pending_bytes
+        out = compressor.compress(data)
+        if out:
+            pending.append(out)
+            pending_bytes += len(out)
+        if pending_bytes < SYNC_CHUNK_BYTES:
+            return None
+        chunk = b"".join(pending)
+        pending.clear()
+        pending_bytes = 0
+        return chunk
+
+    for rel_path in updated:
+        current = after[rel_path]
+        abs_path = os.path.join(root, rel_path.replace("/", os.sep))
+        info = tarfile.TarInfo(rel_path)
+        info.mode = current["mode"]
+        if current["kind"] == "symlink":
+            info.type = tarfile.SYMTYPE
+            info.linkname = current["target"]
+            chunk = feed(info.tobuf(tarfile.PAX_FORMAT))
+            if chunk:
+                yield ("data", chunk)
+            continue
+
+        with open(abs_path, "rb") as fh:
+            info.size = os.fstat(fh.fileno()).st_size
+            chunk = feed(info.tobuf(tarfile.PAX_FORMAT))
+            if chunk:
+                yield ("data", chunk)
+            remaining = info.size
+            while remaining > 0:
+                data = fh.read(min(1024 * 1024, remaining))
+                if not data:
+                    raise RuntimeError(f"{rel_path} shrank while it was being synced back.")
+                remaining -= len(data)
+                chunk = feed(data)
+                if chunk:
+                    yield ("data", chunk)
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            chunk = feed(b"\0" * padding)
+            if chunk:
+                yield ("data", chunk)
+
+    feed(b"\0" * (2 * tarfile.BLOCKSIZE))
+    pending.append(compressor.flush())
+    yield ("data", b"".join(pending))
+
+
+class _ChunkReader(io.RawIOBase):
+    def __init__(self, chunks: Any) -> None:
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, target: Any) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _apply_repo_change_stream(local_root: str, frames: Any) -> dict[str, list[str]]:
+    # Returns the repo-relative paths it wrote ("updated") and deleted ("removed").
+    frames = iter(frames)
+    kind, header = next(frames)
+    if kind != "header":
+        raise RuntimeError(f"Unexpected sync frame {kind!r}; expected header.")
+    _remove_local_paths(local_root, header["removed"])
+    updated: list[str] = []
+
+    decompressor = _decompressor(header["codec"])
+
+    def literal_frames() -> Iterator[bytes]:
+        for frame_kind, data in frames:
+            if frame_kind != "literal":
+                raise RuntimeError(f"Unexpected sync frame {frame_kind!r}; expected literal.")
+            yield data
+
+    def tar_bytes() -> Any:
+        for frame_kind, data in frames:
+            if frame_kind == "delta":
+                _apply_delta(local_root, data, literal_frames())
+                updated.append(data["path"])
+                continue
+            if frame_kind != "data":
+                raise RuntimeError(f"Unexpected sync frame {frame_kind!r}.")
+            out = decompressor.decompress(data)
+            if out:
+                yield out
+
+    with tarfile.open(fileobj=_ChunkReader(tar_bytes()), mode="r|") as tar:
+        for member in tar:
+            abs_path = _prepare_local_path(local_root, member.name)
+            updated.append(member.name)
+            if member.issym():
+                os.symlink(member.linkname, abs_path)
+                continue
+            if not member.isreg():
+                raise RuntimeError(f"Unexpected sync member type for {member.name!r}.")
+
+            source = tar.extractfile(member)
+            with open(abs_path, "wb") as fh:
+                shutil.copyfileobj(source, fh, 1024 * 1024)
+            os.chmod(abs_path, member.mode)
+    return {"updated": updated, "removed": list(header["removed"])}
+
+
+def _blob_path(root: str, digest: str) -> str:
+    return posixpath.join(root, digest[:2], digest)
+
+
+def _build_repo_manifest(root: str, previous: dict[str, Any], previous_ns: int) -> dict[str, dict[str, Any]]:
+    # Digests are reused for files whose stat key matches the last manifest, so only
+    # files touched since the previous run are read. Blobs are content-addressed across
+    # runs, so the digest is pinned to blake2b rather than MODAL_DIGEST_ALGO.
+    manifest: dict[str, dict[str, Any]] = {}
+    pending: list[tuple[str, str, int]] = []
+    for dirpath, dirnames, filenames in os.walk(root, topdown=True):
+        rel_dir = os.path.relpath(dirpath, root)
+        dirnames[:] = [name for name in dirnames if not _ignore_local_path(Path(rel_dir, name))]
+        for filename in filenames:
+            abs_path = os.path.join(dirpath, filename)
+            rel_path = _relative_repo_path(os.path.relpath(abs_path, root))
+            if _ignore_local_path(Path(rel_path)):
+                continue
+            st = os.lstat(abs_path)
+            mode = st.st_mode & 0o777
+
+            if stat.S_ISLNK(st.st_mode):
+                manifest[rel_path] = {"kind": "symlink", "target": os.readlink(abs_path), "mode": mode}
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            key = list(_stat_key(st))
+            entry = previous.get(rel_path)
+            reused_before = entry.get("hashed_ns", previous_ns) if entry else previous_ns
+            if entry and entry["kind"] == "file" and entry.get("stat") == key and st.st_mtime_ns < reused_before:
+                manifest[rel_path] = entry
+                continue
+            manifest[rel_path] = {
+                "kind": "file",
+                "digest": None,
+                "mode": mode,
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "stat": key,
+            }
+            pending.append((rel_path, abs_path, st.st_size))
+
+    digests = _hash_files([(abs_path, size) for _, abs_path, size in pending], "blake2b")
+    for (rel_path, _, _), digest in zip(pending, digests):
+        manifest[rel_path]["digest"] = digest
+    return manifest
+
+
+class MissingRepoBlobs(RuntimeError):
+    # Raised in the container, before the command runs, when blobs the local state
+    # counts as uploaded are not on the volume (e.g. it was pruned or recreated).
+    def __init__(self, digests: list[str]) -> None:
+        super().__init__(list(digests))
+        self.digests = list(digests)
 
+    def __str__(self) -> str:
+        return f"{len(self.digests)} repo blob(s) missing from volume {REPO_VOLUME_NAME!r}."
 
-@app.function(image=image, cpu=CPU, memory=MEMORY_MB, timeout=TIMEOUT_SECONDS)
-def run_cmd_and_collect_changes(cmd: str, workdir: str = REPO_PATH) -> dict[str, Any]:
+
+def _write_repo_state(root: str, state: dict[str, Any]) -> None:
+    # Concurrent pushes (a session server and a one-shot run) each write their own
+    # temp file; the last complete state wins.
+    state_path = Path(root, REPO_MANIFEST_PATH)
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{state_path.name}.", suffix=".tmp", dir=state_path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(json.dumps(state, separators=(",", ":")))
+        os.replace(tmp_name, state_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def _read_repo_state(root: str) -> dict[str, Any]:
+    try:
+        state = json.loads(Path(root, REPO_MANIFEST_PATH).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return state if state.get("volume") == REPO_VOLUME_NAME else {}
+
+
+def _push_repo(root: str, forget: list[str] | None = None, session: bool = False) -> str:
+    # "synced_back" digests are files a session command produced: the session container
+    # already holds them, so only pushes for other containers upload them.
+    state = _read_repo_state(root)
+    taken_ns = time.time_ns()
+    files = _build_repo_manifest(root, state.get("files", {}), state.get("taken_ns", 0))
+    uploaded = set(state.get("uploaded", [])) - set(forget or [])
+    synced_back = set(state.get("synced_back", [])) - set(forget or []) - uploaded
+    body = json.dumps(
+        {
+            rel_path: {k: v for k, v in entry.items() if k not in {"stat", "hashed_ns"}}
+            for rel_path, entry in files.items()
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    manifest_digest = hashlib.blake2b(body, digest_size=32).hexdigest()
+
+    missing: dict[str, str] = {}
+    for rel_path, entry in files.items():
+        if entry["kind"] == "file" and entry["digest"] not in uploaded:
+            if session and entry["digest"] in synced_back:
+                continue
+            missing.setdefault(entry["digest"], rel_path)
+    if missing or manifest_digest not in uploaded:
+        with repo_volume.batch_upload(force=True) as batch:
+            for digest, rel_path in missing.items():
+                batch.put_file(os.path.join(root, rel_path), _blob_path("/", digest))
+            batch.put_file(io.BytesIO(body), f"/manifests/{manifest_digest}.json")
+
+    # A file rewritten while it was being uploaded may not match its digest; leave it
+    # out of the uploaded set and drop its stat key so the next run re-hashes and
+    # re-sends it. The container verifies every blob it copies either way.
+    for digest, rel_path in missing.items():
+        entry = files[rel_path]
+        try:
+            unchanged = list(_stat_key(os.lstat(os.path.join(root, rel_path)))) == entry["stat"]
+        except OSError:
+            unchanged = False
+        if unchanged:
+            uploaded.add(digest)
+        else:
+            entry["stat"] = None
+    uploaded.add(manifest_digest)
+    in_use = {entry["digest"] for entry in files.values() if entry["kind"] == "file"}
+
+    _write_repo_state(
+        root,
+        {
+            "volume": REPO_VOLUME_NAME,
+            "taken_ns": taken_ns,
+            "files": files,
+            "uploaded": sorted(uploaded),
+            "synced_back": sorted((synced_back - uploaded) & in_use),
+        },
+    )
+    return manifest_digest
+
+
+def _with_pushed_repo(root: str, call: Callable[[str], Any], session: bool = False) -> Any:
+    # call(manifest_digest) must not produce output before the container has
+    # materialized the tree (remote generators: pull the first frame inside it), so
+    # a MissingRepoBlobs failure can re-upload those blobs and retry once.
+    try:
+        return call(_push_repo(root, session=session))
+    except MissingRepoBlobs as err:
+        return call(_push_repo(root, forget=err.digests, session=session))
+
+
+def _record_synced_files(root: str, synced: dict[str, list[str]]) -> None:
+    # Files a session command wrote are already in the session container. Entering them
+    # into the manifest state as synced back (hashed here, after they were written
+    # locally) keeps the next push from re-hashing and uploading them.
+    state = _read_repo_state(root)
+    if not state:
+        return
+    files = state.setdefault("files", {})
+    synced_back = set(state.get("synced_back", []))
+    for rel_path in synced.get("removed", []):
+        files.pop(rel_path, None)
+    for rel_path in synced.get("updated", []):
+        if _ignore_local_path(Path(rel_path)):
+            continue
+        abs_path = os.path.join(root, rel_path.replace("/", os.sep))
+        hashed_ns = time.time_ns()
+        try:
+            st = os.lstat(abs_path)
+            if stat.S_ISLNK(st.st_mode):
+                files[rel_path] = {"kind": "symlink", "target": os.readlink(abs_path), "mode": st.st_mode & 0o777}
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            digest = _hash_file(abs_path, st.st_size, "blake2b")
+        except OSError:
+            files.pop(rel_path, None)
+            continue
+        files[rel_path] = {
+            "kind": "file",
+            "digest": digest,
+            "mode": st.st_mode & 0o777,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "stat": list(_stat_key(st)),
+            "hashed_ns": hashed_ns,
+        }
+        if digest not in state.get("uploaded", []):
+            synced_back.add(digest)
+    state["synced_back"] = sorted(synced_back)
+    _write_repo_state(root, state)
+
+
+_MATERIALIZED: dict[str, tuple[Any, ...]] = {}
+
+
+def _place_manifest_entry(root: str, rel_path: str, entry: dict[str, Any]) -> None:
+    abs_path = _prepare_local_path(root, rel_path)
+    if entry["kind"] == "symlink":
+        os.symlink(entry["target"], abs_path)
+        return
+
+    hasher = hashlib.blake2b(digest_size=32)
+    with open(_blob_path(REPO_BLOB_MOUNT, entry["digest"]), "rb") as src, open(abs_path, "wb") as dst:
+        for chunk in iter(lambda: src.read(1024 * 1024), b""):
+            hasher.update(chunk)
+            dst.write(chunk)
+    if hasher.hexdigest() != entry["digest"]:
+        raise RuntimeError(f"Blob for {rel_path!r} does not match its digest; re-run to re-upload it.")
+    os.chmod(abs_path, entry["mode"])
+
+
+def _adopt_manifest_entry(root: str, rel_path: str, entry: dict[str, Any]) -> bool:
+    # A file already in the container (baked into the image, or left by an earlier
+    # input) is kept when it matches the manifest: without reading it if size and mtime
+    # are the ones recorded locally, otherwise after checking its digest.
+    abs_path = os.path.join(root, rel_path.replace("/", os.sep))
+    try:
+        st = os.lstat(abs_path)
+    except OSError:
+        return False
+    if entry["kind"] == "symlink":
+        return stat.S_ISLNK(st.st_mode) and os.readlink(abs_path) == entry["target"]
+    if not stat.S_ISREG(st.st_mode) or entry.get("size", st.st_size) != st.st_size:
+        return False
+    if entry.get("mtime_ns") != st.st_mtime_ns and _hash_file(abs_path, st.st_size, "blake2b") != entry["digest"]:
+        return False
+    if st.st_mode & 0o777 != entry["mode"]:
+        os.chmod(abs_path, entry["mode"])
+    return True
+
+
+def _unlisted_paths(root: str, files: dict[str, Any]) -> list[str]:
+    # Everything in the tree the manifest does not list, outside the ignored paths:
+    # files an earlier command created but never synced back (sync-back off, or the
+    # command failed) and image files deleted locally since. Left in place, they make a
+    # long-lived session tree drift from the local one.
+    unlisted: list[str] = []
+    for dirpath, dirnames, filenames in os.walk(root, topdown=True):
+        rel_dir = os.path.relpath(dirpath, root)
+        dirnames[:] = [name for name in dirnames if not _ignore_local_path(Path(rel_dir, name))]
+        for name in filenames:
+            rel_path = _relative_repo_path(os.path.normpath(os.path.join(rel_dir, name)))
+            if rel_path not in files and not _ignore_local_path(Path(rel_path)):
+                unlisted.append(rel_path)
+    return unlisted
+
+
+def _materialize_repo(manifest_digest: str, root: str = REPO_PATH) -> None:
+    # Warm containers keep the tree from their previous input, so only entries whose
+    # content changed, or whose file the last command touched, are copied again. In a
+    # fresh container, files that already match (e.g. from the image) are only hashed.
+    manifest_path = Path(REPO_BLOB_MOUNT, "manifests", f"{manifest_digest}.json")
+    if not manifest_path.exists():
+        repo_volume.reload()
+    files = json.loads(manifest_path.read_text(encoding="utf-8"))
+
+    _remove_local_paths(root, _unlisted_paths(root, files))
+    for rel_path in [rel_path for rel_path in _MATERIALIZED if rel_path not in files]:
+        del _MATERIALIZED[rel_path]
+
+    pending = []
+    for rel_path, entry in files.items():
+        identity = (entry["kind"], entry.get("digest") or entry.get("target"), entry["mode"])
+        placed = _MATERIALIZED.get(rel_path)
+        touched = True
+        if placed:
+            try:
+                touched = _stat_key(os.lstat(os.path.join(root, rel_path))) != placed[1]
+            except OSError:
+                pass
+            if placed[0] == identity and not touched:
+                continue
+        # An untouched placed file still holds its old content; anything else (unknown,
+        # or written by the last command, e.g. an output synced back) may already match.
+        pending.append((rel_path, entry, identity, touched))
+
+    def needs_copy(item: tuple[str, dict[str, Any], tuple[Any, ...], bool]) -> bool:
+        rel_path, entry, _, check_existing = item
+        return not (check_existing and _adopt_manifest_entry(root, rel_path, entry))
+
+    def blob_missing(entry: dict[str, Any]) -> bool:
+        return entry["kind"] == "file" and not os.path.exists(_blob_path(REPO_BLOB_MOUNT, entry["digest"]))
+
+    os.makedirs(root, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+        to_copy = [item for item, copy in zip(pending, pool.map(needs_copy, pending)) if copy]
+        if any(blob_missing(item[1]) for item in to_copy):
+            repo_volume.reload()
+        missing = sorted({item[1]["digest"] for item in to_copy if blob_missing(item[1])})
+        if missing:
+            raise MissingRepoBlobs(missing)
+        list(pool.map(lambda item: _place_manifest_entry(root, item[0], item[1]), to_copy))
+    for rel_path, _, identity, _ in pending:
+        _MATERIALIZED[rel_path] = (identity, _stat_key(os.lstat(os.path.join(root, rel_path))))
+
+
+def _task_env() -> dict[str, str]:
     env = os.environ.copy()
     env["IN_MODAL_TASK_RUNNER"] = "1"
+    if DEP_CACHE and os.path.isdir(DEP_CACHE_MOUNT):
+        for var, subdir in PACKAGE_CACHE_DIRS.items():
+            env.setdefault(var, posixpath.join(DEP_CACHE_MOUNT, subdir))
+        # The cache volume is a different filesystem, so uv cannot hardlink from it.
+        env.setdefault("UV_LINK_MODE", "copy")
+    return env
 
-    before = _snapshot_repo(REPO_PATH)
-    subprocess.run(["bash", "-lc", cmd], check=True, cwd=workdir, env=env)
-    return _collect_repo_changes(REPO_PATH, before)
 
+def _node_projects(root: str) -> list[tuple[str, str]]:
+    projects = []
+    for dirpath, dirnames, filenames in os.walk(root, topdown=True):
+        dirnames[:] = [name for name in dirnames if name not in {".git", "node_modules"}]
+        for lockfile in NODE_LOCKFILES:
+            if lockfile in filenames:
+                projects.append((dirpath, os.path.join(dirpath, lockfile)))
+                break
+    return projects
 
-@app.local_entrypoint()
-def main(cmd: str = DEFAULT_CMD, workdir: str = ".", sync_back: bool = True) -> None:
+
+def _node_modules_key(lock_path: str) -> str:
+    # node_modules can hold native builds, so the machine type is part of the key.
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{os.path.basename(lock_path)}:{platform.machine()}:".encode("utf-8"))
+    with open(lock_path, "rb") as fh:
+        hasher.update(fh.read())
+    return hasher.hexdigest()
+
+
+_NODE_MODULES_KEYS: dict[str, str] = {}
+
+
+def _restore_dep_cache(root: str) -> None:
+    # Runs before the pre-command snapshot, so restored trees are not synced back.
+    if not (DEP_CACHE and NODE_MODULES_CACHE and os.path.isdir(DEP_CACHE_MOUNT)):
+        return
+    for project_dir, lock_path in _node_projects(root):
+        key = _node_modules_key(lock_path)
+        if _NODE_MODULES_KEYS.get(project_dir) == key:
+            continue
+        cached = posixpath.join(DEP_CACHE_MOUNT, "node_modules", key)
+        if not os.path.isdir(cached):
+            continue
+        target = os.path.join(project_dir, "node_modules")
+        if os.path.lexists(target):
+            _remove_local_paths(project_dir, ["node_modules"])
+        shutil.copytree(cached, target, symlinks=True)
+        os.utime(cached)
+        _NODE_MODULES_KEYS[project_dir] = key
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def _evict_dep_cache() -> None:
+    stamp = posixpath.join(DEP_CACHE_MOUNT, ".last-evict")
+    try:
+        if time.time() - os.path.getmtime(stamp) < DEP_CACHE_EVICT_INTERVAL_S:
+            return
+    except OSError:
+        pass
+    Path(stamp).touch()
+
+    # Least recently restored node_modules trees go first; package manager caches are
+    # only dropped (largest first) if that is not enough, since they re-fill lazily.
+    node_root = posixpath.join(DEP_CACHE_MOUNT, "node_modules")
+    trees = []
+    if os.path.isdir(node_root):
+        for name in os.listdir(node_root):
+            path = posixpath.join(node_root, name)
+            trees.append((os.path.getmtime(path), _dir_size(path), path))
+    caches = [
+        (_dir_size(path), path)
+        for path in (posixpath.join(DEP_CACHE_MOUNT, subdir) for subdir in PACKAGE_CACHE_DIRS.values())
+        if os.path.isdir(path)
+    ]
+    total = sum(size for _, size, _ in trees) + sum(size for size, _ in caches)
+    for _, size, path in sorted(trees):
+        if total <= DEP_CACHE_MAX_BYTES:
+            return
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+    for size, path in sorted(caches, reverse=True):
+        if total <= DEP_CACHE_MAX_BYTES:
+            return
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _save_dep_cache(root: str) -> None:
+    if not (DEP_CACHE and os.path.isdir(DEP_CACHE_MOUNT)):
+        return
+    if NODE_MODULES_CACHE:
+        for project_dir, lock_path in _node_projects(root):
+            source = os.path.join(project_dir, "node_modules")
+            if not os.path.isdir(source) or os.path.islink(source):
+                continue
+            key = _node_modules_key(lock_path)
+            cached = posixpath.join(DEP_CACHE_MOUNT, "node_modules", key)
+            if not os.path.isdir(cached):
+                tmp_path = f"{cached}.tmp-{os.getpid()}-{time.time_ns()}"
+                shutil.copytree(source, tmp_path, symlinks=True)
+                try:
+                    os.rename(tmp_path, cached)
+                except OSError:
+                    # Another container saved the same key first.
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+            _NODE_MODULES_KEYS[project_dir] = key
+    _evict_dep_cache()
+    dep_cache_volume.commit()
+
+
+def _stream_command(cmd: str, workdir: str, env: dict[str, str]) -> Iterator[tuple[str, bytes]]:
+    # Yields ("stdout" | "stderr", bytes) as the command produces output and returns
+    # its exit code. Both pipes are polled without blocking, and whatever is readable
+    # is coalesced into one frame per stream. The command is done when the shell exits:
+    # a background child (`daemon &`) may hold the pipes open for much longer, so after
+    # the exit only what is already buffered is read, the way subprocess.run returned.
+    proc = subprocess.Popen(
+        ["bash", "-lc", cmd],
+        cwd=workdir,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    selector = selectors.DefaultSelector()
+    for kind, pipe in (("stdout", proc.stdout), ("stderr", proc.stderr)):
+        os.set_blocking(pipe.fileno(), False)
+        selector.register(pipe, selectors.EVENT_READ, kind)
+
+    def drain(keys: list[Any]) -> dict[str, bytearray]:
+        merged: dict[str, bytearray] = {}
+        for key in keys:
+            # Bounded, so a fast writer cannot hold back the other stream or the exit check.
+            for _ in range(16):
+                try:
+                    chunk = os.read(key.fd, OUTPUT_CHUNK_BYTES)
+                except BlockingIOError:
+                    break
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    break
+                merged.setdefault(key.data, bytearray()).extend(chunk)
+        return merged
+
+    code = None
+    try:
+        while code is None and selector.get_map():
+            ready = [key for key, _ in selector.select(timeout=0.1)]
+            code = proc.poll()
+            for kind, data in drain(ready).items():
+                yield kind, bytes(data)
+        if selector.get_map():
+            for kind, data in drain(list(selector.get_map().values())).items():
+                yield kind, bytes(data)
+    finally:
+        selector.close()
+        proc.stdout.close()
+        proc.stderr.close()
+    return proc.wait()
+
+
+def _stream_batch(
+    commands: list[dict[str, Any]],
+    max_parallel: int,
+    env: dict[str, str],
+) -> Iterator[tuple[str, bytes]]:
+    # Runs validated batch commands (see _normalize_batch) on a thread pool, each as
+    # soon as everything in its "after" list has succeeded; dependents of a failed
+    # command are skipped. Output lines are prefixed with the command name and the
+    # first failing exit code, in batch order, is returned.
+    events: queue.Queue[tuple[Any, ...]] = queue.Queue()
+    status: dict[int, int | None] = {}
+    waiting = {index: set(command["after"]) for index, command in enumerate(commands)}
+    buffers: dict[tuple[int, str], bytearray] = {}
+    running = 0
+
+    def run_one(index: int) -> None:
+        started = time.perf_counter()
+        code = 1
+        try:
+            stream = _stream_command(commands[index]["cmd"], commands[index]["workdir"], env)
+            while True:
+                try:
+                    kind, data = next(stream)
+                except StopIteration as stop:
+                    code = stop.value
+                    return
+                events.put(("output", index, kind, data))
+        except Exception as err:
+            # A command that cannot start (e.g. Popen failing on a missing workdir) still
+            # has to report "done", or the batch would wait for it until the timeout.
+            code = 127 if isinstance(err, OSError) else 1
+            events.put(("output", index, "stderr", f"{type(err).__name__}: {err}\n".encode("utf-8")))
+        finally:
+            events.put(("done", index, code, time.perf_counter() - started))
+
+    def prefixed(index: int, kind: str, data: bytes, final: bool = False) -> bytes:
+        buffer = buffers.setdefault((index, kind), bytearray())
+        buffer.extend(data)
+        cut = len(buffer) if final else buffer.rfind(b"\n") + 1
+        lines, buffer[:] = bytes(buffer[:cut]), buffer[cut:]
+        if final and lines and not lines.endswith(b"\n"):
+            lines += b"\n"
+        prefix = f"[{commands[index]['name']}] ".encode("utf-8")
+        return b"".join(prefix + line for line in lines.splitlines(keepends=True))
+
+    def schedule() -> list[int]:
+        nonlocal running
+        skipped = []
+        changed = True
+        while changed:
+            changed = False
+            for index in sorted(waiting):
+                deps = waiting[index]
+                if any(dep in status and status[dep] != 0 for dep in deps):
+                    del waiting[index]
+                    status[index] = None
+                    skipped.append(index)
+                    changed = True
+                elif all(status.get(dep) == 0 for dep in deps):
+                    del waiting[index]
+                    running += 1
+                    pool.submit(run_one, index)
+        return skipped
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as pool:
+        skipped = schedule()
+        while True:
+            for index in skipped:
+                yield "stderr", f"[{commands[index]['name']}] skipped: a dependency failed\n".encode("utf-8")
+            skipped = []
+            if not running:
+                break
+            event = events.get()
+            if event[0] == "output":
+                _, index, kind, data = event
+                lines = prefixed(index, kind, data)
+                if lines:
+                    yield kind, lines
+                continue
+
+            _, index, code, elapsed = event
+            running -= 1
+            status[index] = code
+            for kind in ("stdout", "stderr"):
+                lines = prefixed(index, kind, b"", final=True)
+                if lines:
+                    yield kind, lines
+            yield "stderr", f"[{commands[index]['name']}] exit {code} in {elapsed:.1f}s\n".encode("utf-8")
+            skipped = schedule()
+
+    for index in range(len(commands)):
+        if status[index] is None:
+            return 1
+        if status[index] != 0:
+            return status[index]
+    return 0
+
+
+def _run_and_stream(
+    command_stream: Callable[[dict[str, str]], Iterator[tuple[str, bytes]]],
+    codecs: list[str] | None,
+    manifest_digest: str,
+    sync_back: bool,
+) -> Iterator[tuple[str, Any]]:
+    # Frames: live ("stdout" | "stderr", bytes), then ("exit", code), then the sync-back
+    # stream (header, delta, data) when the command succeeded and sync_back is set.
+    if manifest_digest:
+        _materialize_repo(manifest_digest)
+    _restore_dep_cache(REPO_PATH)
+
+    stat_index: dict[str, Any] | None = {} if SNAPSHOT_MODE == "stat" else None
+    before = _snapshot_repo(REPO_PATH, stat_index) if sync_back else {}
+    signatures = _delta_signatures(REPO_PATH, before) if sync_back and SYNC_DELTA else None
+    code = yield from command_stream(_task_env())
+    if code == 0:
+        _save_dep_cache(REPO_PATH)
+    yield ("exit", code)
+    if sync_back and code == 0:
+        yield from _stream_repo_changes(REPO_PATH, before, stat_index, codecs or ["gzip"], signatures)
+
+
+def _split_command_frames(
+    frames: Any,
+    on_output: Callable[[str, bytes], None],
+) -> tuple[int, Iterator[tuple[str, Any]] | None]:
+    frames = iter(frames)
+    for kind, data in frames:
+        if kind in {"stdout", "stderr"}:
+            on_output(kind, data)
+            continue
+        if kind != "exit":
+            raise RuntimeError(f"Unexpected command frame {kind!r}.")
+        first = next(frames, None)
+        return data, None if first is None else itertools.chain([first], frames)
+    raise RuntimeError("Command stream ended without an exit code.")
+
+
+def _write_output(kind: str, data: bytes) -> None:
+    stream = sys.stdout if kind == "stdout" else sys.stderr
+    stream.buffer.write(data)
+    stream.buffer.flush()
+
+
+@app.function(image=image, cpu=CPU, memory=MEMORY_MB, timeout=TIMEOUT_SECONDS, volumes=function_volumes)
+def run_cmd(cmd: str, workdir: str = REPO_PATH, manifest_digest: str = "") -> int:
+    if manifest_digest:
+        _materialize_repo(manifest_digest)
+    _restore_dep_cache(REPO_PATH)
+    code = subprocess.run(["bash", "-lc", cmd], cwd=workdir, env=_task_env()).returncode
+    if code == 0:
+        _save_dep_cache(REPO_PATH)
+    return code
+
+
+@app.function(image=image, cpu=CPU, memory=MEMORY_MB, timeout=TIMEOUT_SECONDS, volumes=function_volumes)
+def run_cmd_and_collect_changes(cmd: str, workdir: str = REPO_PATH, manifest_digest: str = "") -> dict[str, Any]:
+    if manifest_digest:
+        _materialize_repo(manifest_digest)
+    _restore_dep_cache(REPO_PATH)
+
+    stat_index: dict[str, Any] | None = {} if SNAPSHOT_MODE == "stat" else None
+    before = _snapshot_repo(REPO_PATH, stat_index)
+    signatures = _delta_signatures(REPO_PATH, before) if SYNC_DELTA else None
+    code = subprocess.run(["bash", "-lc", cmd], cwd=workdir, env=_task_env()).returncode
+    if code != 0:
+        return {"exit_code": code}
+    _save_dep_cache(REPO_PATH)
+    return {**_collect_repo_changes(REPO_PATH, before, stat_index, signatures), "exit_code": 0}
+
+
+@app.function(image=image, cpu=CPU, memory=MEMORY_MB, timeout=TIMEOUT_SECONDS, volumes=function_volumes)
+def run_cmd_and_stream_changes(
+    cmd: str,
+    workdir: str = REPO_PATH,
+    codecs: list[str] | None = None,
+    manifest_digest: str = "",
+    sync_back: bool = True,
+) -> Any:
+    yield from _run_and_stream(
+        lambda env: _stream_command(cmd, workdir, env), codecs, manifest_digest, sync_back
+    )
+
+
+@app.function(
+    image=image,
+    cpu=CPU,
+    memory=MEMORY_MB,
+    timeout=TIMEOUT_SECONDS,
+    volumes={**function_volumes, REPO_BLOB_MOUNT: repo_volume},
+    max_containers=1,
+    scaledown_window=SESSION_IDLE_SECONDS,
+)
+def session_exec(
+    cmd: str,
+    workdir: str = REPO_PATH,
+    codecs: list[str] | None = None,
+    manifest_digest: str = "",
+    sync_back: bool = True,
+) -> Any:
+    # One warm container serves every command of a session: the materialized tree
+    # persists between calls, so each command only pays for files changed since the
+    # previous one, in either direction.
+    yield from _run_and_stream(
+        lambda env: _stream_command(cmd, workdir, env), codecs, manifest_digest, sync_back
+    )
+
+
+@app.function(image=image, cpu=CPU, memory=MEMORY_MB, timeout=TIMEOUT_SECONDS, volumes=function_volumes)
+def run_batch_and_stream_changes(
+    commands: list[dict[str, Any]],
+    codecs: list[str] | None = None,
+    manifest_digest: str = "",
+    sync_back: bool = True,
+    max_parallel: int = 0,
+) -> Any:
+    # One container, one snapshot pair and one coalesced change set for the whole batch.
+    yield from _run_and_stream(
+        lambda env: _stream_batch(commands, max_parallel or max(1, int(CPU)), env),
+        codecs,
+        manifest_digest,
+        sync_back,
+    )
+
+
+def _normalize_workdir(workdir: str) -> str:
     normalized_workdir = posixpath.normpath(posixpath.join(REPO_PATH, workdir))
     if normalized_workdir != REPO_PATH and not normalized_workdir.startswith(f"{REPO_PATH}/"):
         raise ValueError(f"Invalid workdir outside repo: {workdir}")
+    return normalized_workdir
 
-    if not sync_back:
-        run_cmd.remote(cmd, normalized_workdir)
-        return
 
-    changes = run_cmd_and_collect_changes.remote(cmd, normalized_workdir)
-    if changes.get("updated") or changes.get("removed"):
-        _apply_repo_changes(os.getcwd(), changes)
+def _normalize_batch(spec: Any, local_root: str) -> list[dict[str, Any]]:
+    # Accepts a list of commands or {"commands": [...]}. Each command is a string or
+    # {"name", "cmd", "workdir" (repo-relative), "after": [names]}. Workdirs must exist
+    # in the local checkout, which is what the container receives.
+    items = spec.get("commands", []) if isinstance(spec, dict) else spec
+    if not isinstance(items, list) or not items:
+        raise ValueError("Batch spec must contain a non-empty list of commands.")
+
+    commands: list[dict[str, Any]] = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"cmd": item}
+        if not isinstance(item, dict) or not item.get("cmd"):
+            raise ValueError(f"Batch command #{index} needs a 'cmd'.")
+        after = item.get("after", [])
+        workdir = _normalize_workdir(item.get("workdir", "."))
+        if not os.path.isdir(os.path.join(local_root, posixpath.relpath(workdir, REPO_PATH))):
+            raise ValueError(f"Batch command #{index} workdir does not exist: {item.get('workdir')}")
+        commands.append(
+            {
+                "name": str(item.get("name") or index),
+                "cmd": item["cmd"],
+                "workdir": workdir,
+                "after": [after] if isinstance(after, str) else list(after),
+            }
+        )
+
+    by_name = {command["name"]: index for index, command in enumerate(commands)}
+    if len(by_name) != len(commands):
+        raise ValueError("Batch command names must be unique.")
+    for command in commands:
+        unknown = [dep for dep in command["after"] if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Batch command {command['name']!r} depends on unknown {unknown}.")
+        command["after"] = [by_name[dep] for dep in command["after"]]
+
+    visiting: set[int] = set()
+    done: set[int] = set()
+
+    def visit(index: int) -> None:
+        if index in done:
+            return
+        if index in visiting:
+            raise ValueError(f"Batch dependencies form a cycle at {commands[index]['name']!r}.")
+        visiting.add(index)
+        for dep in commands[index]["after"]:
+            visit(dep)
+        visiting.discard(index)
+        done.add(index)
+
+    for index in range(len(commands)):
+        visit(index)
+    return commands
+
+
+@app.local_entrypoint()
+def main(cmd: str = DEFAULT_CMD, workdir: str = ".", sync_back: bool = True) -> None:
+    normalized_workdir = _normalize_workdir(workdir)
+    if REPO_SYNC not in {"image", "volume"}:
+        raise ValueError("MODAL_REPO_SYNC must be one of: image, volume")
+
+    def execute(manifest_digest: str) -> tuple[int, Any]:
+        if SYNC_TRANSPORT == "stream":
+            frames = run_cmd_and_stream_changes.remote_gen(
+                cmd, normalized_workdir, _local_sync_codecs(), manifest_digest=manifest_digest, sync_back=sync_back
+            )
+            return _split_command_frames(frames, _write_output)
+        if not sync_back:
+            return run_cmd.remote(cmd, normalized_workdir, manifest_digest=manifest_digest), None
+        changes = run_cmd_and_collect_changes.remote(cmd, normalized_workdir, manifest_digest=manifest_digest)
+        return changes["exit_code"], changes
+
+    code, synced = _with_pushed_repo(os.getcwd(), execute) if REPO_SYNC == "volume" else execute("")
+    if SYNC_TRANSPORT == "stream":
+        if synced is not None:
+            _apply_repo_change_stream(os.getcwd(), synced)
+    elif synced and (synced.get("updated") or synced.get("removed")):
+        _apply_repo_changes(os.getcwd(), synced)
+
+    if code:
+        raise SystemExit(code)
+
+
+@app.local_entrypoint()
+def batch(spec: str, sync_back: bool = True, max_parallel: int = 0) -> None:
+    spec_path = Path(spec)
+    commands = _normalize_batch(
+        json.loads(spec_path.read_text(encoding="utf-8") if spec_path.is_file() else spec), os.getcwd()
+    )
+    if REPO_SYNC not in {"image", "volume"}:
+        raise ValueError("MODAL_REPO_SYNC must be one of: image, volume")
+
+    def execute(manifest_digest: str) -> tuple[int, Any]:
+        frames = run_batch_and_stream_changes.remote_gen(
+            commands,
+            _local_sync_codecs(),
+            manifest_digest=manifest_digest,
+            sync_back=sync_back,
+            max_parallel=max_parallel,
+        )
+        return _split_command_frames(frames, _write_output)
+
+    code, sync_frames = _with_pushed_repo(os.getcwd(), execute) if REPO_SYNC == "volume" else execute("")
+    if sync_frames is not None:
+        _apply_repo_change_stream(os.getcwd(), sync_frames)
+    if code:
+        raise SystemExit(code)
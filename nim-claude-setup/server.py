@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
+import asyncio
+import hashlib
+import http.client
 import json
 import os
+import select
+import signal
+import sqlite3
+import ssl
+import threading
 import time
 import uuid
+from collections import OrderedDict
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-from urllib.error import HTTPError, URLError
 from urllib.parse import urlparse
-from urllib.request import Request, urlopen
 
 PORT = int(os.getenv("NIM_PROXY_PORT", "8090"))
 NIM_BASE_URL = os.getenv("NIM_API_BASE_URL", "https://integrate.api.nvidia.com/v1").rstrip("/")
@@ -17,6 +24,19 @@ PRIMARY_FALLBACK_MODEL = os.getenv("NIM_PRIMARY_FALLBACK_MODEL", SECONDARY_MODEL
 PRIMARY_DISPLAY_NAME = os.getenv("NIM_PRIMARY_DISPLAY_NAME", "Qwen 3 Coder 480B (Default)")
 SECONDARY_DISPLAY_NAME = os.getenv("NIM_SECONDARY_DISPLAY_NAME", "Qwen 2.5 Coder 32B (Secondary)")
 MAX_OUTPUT_TOKENS = int(os.getenv("NIM_MAX_OUTPUT_TOKENS", "768"))
+POOL_MAX_PER_HOST = int(os.getenv("NIM_PROXY_POOL_SIZE", "8"))
+POOL_IDLE_SECONDS = float(os.getenv("NIM_PROXY_POOL_IDLE_SECONDS", "60"))
+STREAM_UPSTREAM = os.getenv("NIM_PROXY_STREAM_UPSTREAM", "1").strip().lower() not in ("0", "false", "no")
+ENGINE = os.getenv("NIM_PROXY_ENGINE", "thread").strip().lower()
+MAX_CONCURRENCY = int(os.getenv("NIM_PROXY_MAX_CONCURRENCY", "256"))
+SHUTDOWN_GRACE_SECONDS = float(os.getenv("NIM_PROXY_SHUTDOWN_GRACE_SECONDS", "10"))
+CACHE_ENABLED = os.getenv("NIM_PROXY_CACHE", "1").strip().lower() not in ("0", "false", "no")
+CACHE_MAX_ENTRIES = int(os.getenv("NIM_PROXY_CACHE_SIZE", "512"))
+CACHE_TTL_SECONDS = float(os.getenv("NIM_PROXY_CACHE_TTL_SECONDS", "3600"))
+CACHE_DB_PATH = os.path.expanduser(os.getenv("NIM_PROXY_CACHE_DB", ""))
+CACHE_DB_MAX_ENTRIES = int(os.getenv("NIM_PROXY_CACHE_DB_MAX_ENTRIES", "10000"))
+COALESCE = os.getenv("NIM_PROXY_COALESCE", "1").strip().lower() not in ("0", "false", "no")
+COALESCE_SAMPLED = os.getenv("NIM_PROXY_COALESCE_SAMPLED", "0").strip().lower() in ("1", "true", "yes")
 
 
 def _utc_iso_now():
@@ -217,42 +237,1090 @@ def _extract_nim_text(response_json):
     return ""
 
 
-def _nim_request(path, api_key, payload=None):
-    url = f"{NIM_BASE_URL}/{path.lstrip('/')}"
-    headers = {
+def _nim_headers(api_key, accept="application/json"):
+    return {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
-        "Accept": "application/json",
+        "Accept": accept,
         "User-Agent": "nim-claude-proxy/1.0",
     }
 
-    body = None
-    method = "GET"
-    if payload is not None:
-        body = json.dumps(payload).encode("utf-8")
-        method = "POST"
 
-    req = Request(url=url, data=body, headers=headers, method=method)
+class _ConnectionPool:
+    # Keep-alive upstream connections shared by all handler threads, so a request
+    # reuses an open TLS session instead of paying a new TCP + TLS handshake. At most
+    # max_per_host connections per host are pooled; a request that finds them all busy
+    # opens an unpooled one, closed after use, rather than waiting for a free slot.
+
+    def __init__(self, max_per_host, idle_seconds, timeout):
+        self.max_per_host = max(1, max_per_host)
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._open = {}
+        self._ssl_context = ssl.create_default_context()
+        self.created = 0
+        self.reused = 0
+        self.unpooled = 0
+
+    def _healthy(self, conn, idle_since):
+        if time.monotonic() - idle_since > self.idle_seconds or conn.sock is None:
+            return False
+        # An idle keep-alive socket must not be readable: readable means the server
+        # closed it (EOF) or sent something unexpected.
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def acquire(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            while idle:
+                conn, idle_since = idle.pop()
+                if self._healthy(conn, idle_since):
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+                self._open[key] -= 1
+            pooled = self._open.get(key, 0) < self.max_per_host
+            if pooled:
+                self._open[key] = self._open.get(key, 0) + 1
+            else:
+                self.unpooled += 1
+            self.created += 1
+
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        conn.pool_key = key
+        conn.pooled = pooled
+        return conn, False
+
+    def release(self, conn, reuse):
+        with self._lock:
+            if conn.pooled and reuse and conn.sock is not None:
+                self._idle.setdefault(conn.pool_key, []).append((conn, time.monotonic()))
+                return
+            conn.close()
+            if conn.pooled:
+                self._open[conn.pool_key] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open": sum(self._open.values()),
+                "idle": sum(len(idle) for idle in self._idle.values()),
+                "created": self.created,
+                "reused": self.reused,
+                "unpooled": self.unpooled,
+                "max_per_host": self.max_per_host,
+            }
+
+
+_UPSTREAM_POOL = _ConnectionPool(POOL_MAX_PER_HOST, POOL_IDLE_SECONDS, NIM_TIMEOUT_SECONDS)
+# A reused socket the server already dropped fails on send or on the status line;
+# those requests never reached upstream and are retried once on a fresh connection.
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class _PooledResponse:
+    # Open streaming response; iterating yields raw lines. close(drain=True) reads what
+    # is left after the final event (the chunked terminator) so the connection can go
+    # back to the pool; an abandoned stream is dropped instead of read to the end.
+
+    def __init__(self, conn, resp):
+        self._conn = conn
+        self._resp = resp
+
+    def __iter__(self):
+        return iter(self._resp.readline, b"")
+
+    def close(self, drain=False):
+        if self._conn is None:
+            return
+        if drain and not self._resp.isclosed():
+            try:
+                self._resp.read()
+            except (http.client.HTTPException, OSError):
+                pass
+        reuse = self._resp.isclosed() and not self._resp.will_close
+        if not reuse:
+            self._resp.close()
+        _UPSTREAM_POOL.release(self._conn, reuse)
+        self._conn = None
+
+
+def _nim_send(method, path, api_key, payload, accept="application/json"):
+    # Returns (conn, response) with the response headers read; the caller reads the body
+    # and releases the connection.
+    url = urlparse(f"{NIM_BASE_URL}/{path.lstrip('/')}")
+    port = url.port or (443 if url.scheme == "https" else 80)
+    body = json.dumps(payload).encode("utf-8") if payload is not None else None
+
+    for attempt in (0, 1):
+        conn, reused = _UPSTREAM_POOL.acquire(url.scheme, url.hostname, port)
+        try:
+            conn.request(method, url.path, body=body, headers=_nim_headers(api_key, accept))
+            return conn, conn.getresponse()
+        except _STALE_CONNECTION_ERRORS:
+            _UPSTREAM_POOL.release(conn, False)
+            if reused and attempt == 0:
+                continue
+            raise
+        except BaseException:
+            _UPSTREAM_POOL.release(conn, False)
+            raise
 
+
+def _nim_request(path, api_key, payload=None):
+    method = "POST" if payload is not None else "GET"
     try:
-        with urlopen(req, timeout=NIM_TIMEOUT_SECONDS) as resp:
-            return resp.getcode(), resp.read(), dict(resp.headers)
-    except HTTPError as err:
-        return err.code, err.read(), dict(err.headers)
-    except URLError as err:
+        conn, resp = _nim_send(method, path, api_key, payload)
+        try:
+            data = resp.read()
+        except BaseException:
+            _UPSTREAM_POOL.release(conn, False)
+            raise
+        _UPSTREAM_POOL.release(conn, not resp.will_close)
+        return resp.status, data, dict(resp.getheaders())
+    except (http.client.HTTPException, OSError) as err:
         return 0, json.dumps({"error": {"message": str(err)}}).encode("utf-8"), {}
-    except TimeoutError as err:
+
+
+def _nim_open_stream(path, api_key, payload):
+    # Like _nim_request, but on success returns an open _PooledResponse instead of its
+    # body; the caller reads the SSE lines and must close it.
+    try:
+        conn, resp = _nim_send("POST", path, api_key, payload, "text/event-stream")
+        if resp.status >= 400:
+            data = resp.read()
+            _UPSTREAM_POOL.release(conn, not resp.will_close)
+            return resp.status, data, dict(resp.getheaders())
+        return resp.status, _PooledResponse(conn, resp), dict(resp.getheaders())
+    except (http.client.HTTPException, OSError) as err:
         return 0, json.dumps({"error": {"message": str(err)}}).encode("utf-8"), {}
-    except OSError as err:
+
+
+class _AsyncConnection:
+    def __init__(self, key, reader, writer):
+        self.pool_key = key
+        self.reader = reader
+        self.writer = writer
+
+
+class _AsyncConnectionPool:
+    # The asyncio engine's counterpart of _ConnectionPool. It runs on the event loop
+    # thread only, so it needs no locking; in-flight requests are already bounded by
+    # NIM_PROXY_MAX_CONCURRENCY, so only the idle connections kept per host are capped.
+
+    def __init__(self, max_idle_per_host, idle_seconds, timeout):
+        self.max_idle_per_host = max(1, max_idle_per_host)
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._idle = {}
+        self._ssl_context = ssl.create_default_context()
+        self.open = 0
+        self.created = 0
+        self.reused = 0
+
+    def _healthy(self, conn, idle_since):
+        # The transport keeps reading while the connection is idle, so a server-side
+        # close shows up as EOF on the reader.
+        if time.monotonic() - idle_since > self.idle_seconds:
+            return False
+        return not conn.reader.at_eof() and not conn.writer.is_closing()
+
+    def _discard(self, conn):
+        conn.writer.close()
+        self.open -= 1
+
+    async def acquire(self, scheme, host, port):
+        key = (scheme, host, port)
+        idle = self._idle.setdefault(key, [])
+        while idle:
+            conn, idle_since = idle.pop()
+            if self._healthy(conn, idle_since):
+                self.reused += 1
+                return conn, True
+            self._discard(conn)
+
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=self._ssl_context if scheme == "https" else None),
+            self.timeout,
+        )
+        self.open += 1
+        self.created += 1
+        return _AsyncConnection(key, reader, writer), False
+
+    def release(self, conn, reuse):
+        idle = self._idle.setdefault(conn.pool_key, [])
+        if reuse and len(idle) < self.max_idle_per_host and not conn.writer.is_closing():
+            idle.append((conn, time.monotonic()))
+        else:
+            self._discard(conn)
+
+    def close_idle(self):
+        for idle in self._idle.values():
+            while idle:
+                self._discard(idle.pop()[0])
+
+    def stats(self):
+        return {
+            "open": self.open,
+            "idle": sum(len(idle) for idle in self._idle.values()),
+            "created": self.created,
+            "reused": self.reused,
+            "max_idle_per_host": self.max_idle_per_host,
+        }
+
+
+_ASYNC_UPSTREAM_POOL = _AsyncConnectionPool(POOL_MAX_PER_HOST, POOL_IDLE_SECONDS, NIM_TIMEOUT_SECONDS)
+_ASYNC_STALE_CONNECTION_ERRORS = (BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError)
+# Everything an upstream exchange can raise: socket errors, timeouts, truncated bodies
+# and unparsable status lines or chunk sizes.
+_ASYNC_UPSTREAM_ERRORS = (OSError, EOFError, ValueError, asyncio.TimeoutError)
+
+
+async def _upstream_io(awaitable):
+    return await asyncio.wait_for(awaitable, NIM_TIMEOUT_SECONDS)
+
+
+class _AsyncResponse:
+    # Minimal HTTP/1.1 response body reader (Content-Length, chunked or read-to-close)
+    # over a pooled connection. Like _PooledResponse, close(drain=True) reads what is
+    # left so the connection can go back to the pool.
+
+    def __init__(self, conn, version, status, headers):
+        self._conn = conn
+        self.status = status
+        self.headers = headers
+        self._chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        length = headers.get("content-length")
+        if status in (204, 304):
+            self._remaining = 0
+        else:
+            self._remaining = None if self._chunked or length is None else _safe_int(length, 0)
+        self._done = False
+        self.will_close = (
+            version == "HTTP/1.0"
+            or headers.get("connection", "").lower() == "close"
+            or (not self._chunked and self._remaining is None)
+        )
+
+    async def _next_piece(self):
+        if self._done:
+            return b""
+        reader = self._conn.reader
+        if self._chunked:
+            line = await _upstream_io(reader.readline())
+            if not line:
+                raise ConnectionResetError("Upstream closed the connection mid-response.")
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                # Optional trailers, then the blank line that ends the body.
+                while (await _upstream_io(reader.readline())) not in (b"\r\n", b"\n", b""):
+                    pass
+                self._done = True
+                return b""
+            data = await _upstream_io(reader.readexactly(size + 2))
+            return data[:-2]
+        if self._remaining is None:
+            data = await _upstream_io(reader.read(65536))
+            self._done = not data
+            return data
+        if self._remaining == 0:
+            self._done = True
+            return b""
+        data = await _upstream_io(reader.read(min(self._remaining, 65536)))
+        if not data:
+            raise ConnectionResetError("Upstream closed the connection mid-response.")
+        self._remaining -= len(data)
+        return data
+
+    async def read(self):
+        parts = []
+        while True:
+            data = await self._next_piece()
+            if not data:
+                return b"".join(parts)
+            parts.append(data)
+
+    async def lines(self):
+        pending = b""
+        while True:
+            data = await self._next_piece()
+            if not data:
+                if pending:
+                    yield pending
+                return
+            *complete, pending = (pending + data).split(b"\n")
+            for line in complete:
+                yield line
+
+    async def close(self, drain=False):
+        if self._conn is None:
+            return
+        if drain and not self._done:
+            try:
+                await self.read()
+            except _ASYNC_UPSTREAM_ERRORS:
+                pass
+        _ASYNC_UPSTREAM_POOL.release(self._conn, self._done and not self.will_close)
+        self._conn = None
+
+
+async def _read_response_head(conn):
+    line = await _upstream_io(conn.reader.readline())
+    if not line:
+        raise ConnectionResetError("Upstream closed the connection.")
+    parts = line.decode("latin-1").split(None, 2)
+    if len(parts) < 2:
+        raise ValueError(f"Malformed upstream status line: {line!r}")
+    headers = {}
+    while True:
+        line = await _upstream_io(conn.reader.readline())
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return _AsyncResponse(conn, parts[0], int(parts[1]), headers)
+
+
+async def _async_nim_send(method, path, api_key, payload, accept="application/json"):
+    # asyncio version of _nim_send; returns an _AsyncResponse with the headers read.
+    url = urlparse(f"{NIM_BASE_URL}/{path.lstrip('/')}")
+    default_port = 443 if url.scheme == "https" else 80
+    port = url.port or default_port
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    headers = _nim_headers(api_key, accept)
+    headers["Host"] = url.hostname if port == default_port else f"{url.hostname}:{port}"
+    headers["Content-Length"] = str(len(body))
+    head = f"{method} {url.path} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+
+    for attempt in (0, 1):
+        conn, reused = await _ASYNC_UPSTREAM_POOL.acquire(url.scheme, url.hostname, port)
+        try:
+            conn.writer.write(head.encode("latin-1") + body)
+            await _upstream_io(conn.writer.drain())
+            return await _read_response_head(conn)
+        except _ASYNC_STALE_CONNECTION_ERRORS:
+            _ASYNC_UPSTREAM_POOL.release(conn, False)
+            if reused and attempt == 0:
+                continue
+            raise
+        except BaseException:
+            _ASYNC_UPSTREAM_POOL.release(conn, False)
+            raise
+
+
+async def _async_nim_request(path, api_key, payload=None):
+    method = "POST" if payload is not None else "GET"
+    try:
+        resp = await _async_nim_send(method, path, api_key, payload)
+        try:
+            data = await resp.read()
+        finally:
+            await resp.close()
+        return resp.status, data, resp.headers
+    except _ASYNC_UPSTREAM_ERRORS as err:
+        return 0, json.dumps({"error": {"message": str(err)}}).encode("utf-8"), {}
+
+
+async def _async_nim_open_stream(path, api_key, payload):
+    try:
+        resp = await _async_nim_send("POST", path, api_key, payload, "text/event-stream")
+        if resp.status >= 400:
+            try:
+                data = await resp.read()
+            finally:
+                await resp.close()
+            return resp.status, data, resp.headers
+        return resp.status, resp, resp.headers
+    except _ASYNC_UPSTREAM_ERRORS as err:
         return 0, json.dumps({"error": {"message": str(err)}}).encode("utf-8"), {}
 
 
+def _nim_error_message(nim_body):
+    msg = "NVIDIA NIM API request failed."
+    try:
+        parsed = json.loads(nim_body.decode("utf-8"))
+        if isinstance(parsed, dict):
+            err = parsed.get("error")
+            if isinstance(err, dict) and isinstance(err.get("message"), str):
+                msg = err["message"]
+    except Exception:
+        pass
+    return msg
+
+
+_SSE_DONE = object()
+
+
+def _parse_sse_line(raw):
+    # One OpenAI-style SSE line -> its JSON object, _SSE_DONE for "data: [DONE]", or None.
+    line = raw.decode("utf-8", errors="replace").strip() if isinstance(raw, bytes) else raw.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return _SSE_DONE
+    try:
+        parsed = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _iter_sse_json(lines):
+    # OpenAI-style SSE: one JSON object per "data:" line, terminated by "data: [DONE]".
+    for raw in lines:
+        parsed = _parse_sse_line(raw)
+        if parsed is _SSE_DONE:
+            return
+        if parsed is not None:
+            yield parsed
+
+
+def _stop_reason(finish_reason):
+    return "max_tokens" if finish_reason == "length" else "end_turn"
+
+
+def _message_start_event(msg_id, model, in_tok):
+    return "message_start", {
+        "type": "message_start",
+        "message": {
+            "id": msg_id,
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": {"input_tokens": in_tok, "output_tokens": 0},
+        },
+    }
+
+
+def _text_delta_event(text):
+    return "content_block_delta", {
+        "type": "content_block_delta",
+        "index": 0,
+        "delta": {"type": "text_delta", "text": text},
+    }
+
+
+def _text_events(msg_id, model, text, in_tok, out_tok, stop_reason="end_turn"):
+    # A complete completion as Anthropic SSE events, with the text in fixed-size deltas.
+    yield _message_start_event(msg_id, model, in_tok)
+    yield "content_block_start", {
+        "type": "content_block_start",
+        "index": 0,
+        "content_block": {"type": "text", "text": ""},
+    }
+    for chunk in _chunk_text(text):
+        yield _text_delta_event(chunk)
+    yield "content_block_stop", {"type": "content_block_stop", "index": 0}
+    yield "message_delta", {
+        "type": "message_delta",
+        "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+        "usage": {"output_tokens": out_tok},
+    }
+    yield "message_stop", {"type": "message_stop"}
+
+
+class _StreamTranslator:
+    # OpenAI chat.completion.chunk objects -> Anthropic SSE events, one text delta per
+    # upstream delta. Chunks are pushed in (feed) so the thread and asyncio engines share
+    # it. Usage only arrives in the last chunk (stream_options.include_usage), so it is
+    # reported in message_delta; stats receives it for logging.
+
+    def __init__(self, msg_id, model, stats):
+        self.msg_id = msg_id
+        self.model = model
+        self.stats = stats
+        self._finish_reason = None
+        self._sent_text = False
+        self._reasoning = []
+
+    def start(self):
+        return [
+            _message_start_event(self.msg_id, self.model, 0),
+            ("content_block_start", {
+                "type": "content_block_start",
+                "index": 0,
+                "content_block": {"type": "text", "text": ""},
+            }),
+        ]
+
+    def feed(self, chunk):
+        stats = self.stats
+        usage = chunk.get("usage")
+        if isinstance(usage, dict):
+            stats["input_tokens"] = _safe_int(usage.get("prompt_tokens", 0), 0)
+            stats["output_tokens"] = _safe_int(usage.get("completion_tokens", 0), 0)
+        choices = chunk.get("choices")
+        if not isinstance(choices, list) or not choices or not isinstance(choices[0], dict):
+            return []
+
+        events = []
+        choice = choices[0]
+        delta = choice.get("delta") if isinstance(choice.get("delta"), dict) else {}
+        content = delta.get("content")
+        if isinstance(content, str) and content:
+            self._sent_text = True
+            stats["text"] = stats.get("text", "") + content
+            events.append(_text_delta_event(content))
+        elif isinstance(delta.get("reasoning_content"), str):
+            self._reasoning.append(delta["reasoning_content"])
+        if choice.get("finish_reason"):
+            self._finish_reason = choice["finish_reason"]
+        return events
+
+    def finish(self):
+        stats = self.stats
+        events = []
+        # Same rule as _extract_nim_text: reasoning is only surfaced when there is no content.
+        if not self._sent_text and self._reasoning:
+            stats["text"] = "".join(self._reasoning)
+            events.append(_text_delta_event(stats["text"]))
+
+        stats["stop_reason"] = _stop_reason(self._finish_reason)
+        events.append(("content_block_stop", {"type": "content_block_stop", "index": 0}))
+        events.append(("message_delta", {
+            "type": "message_delta",
+            "delta": {"stop_reason": stats["stop_reason"], "stop_sequence": None},
+            "usage": {"input_tokens": stats.get("input_tokens", 0), "output_tokens": stats.get("output_tokens", 0)},
+        }))
+        events.append(("message_stop", {"type": "message_stop"}))
+        return events
+
+
+def _translate_nim_stream(chunks, msg_id, model, stats):
+    translator = _StreamTranslator(msg_id, model, stats)
+    yield from translator.start()
+    for chunk in chunks:
+        yield from translator.feed(chunk)
+    yield from translator.finish()
+
+
+def _sse_bytes(event_name, payload):
+    data = json.dumps(payload, ensure_ascii=False)
+    return f"event: {event_name}\ndata: {data}\n\n".encode("utf-8")
+
+
 def _chunk_text(text, size=320):
     if not text:
         return []
     return [text[i : i + size] for i in range(0, len(text), size)]
 
 
+class _ResponseCache:
+    # Finished completions for deterministic requests, keyed on the translated payload:
+    # an in-memory LRU in front of an optional SQLite file. Both tiers expire entries
+    # after ttl_seconds and keep at most their own entry limit.
+
+    def __init__(self, max_entries, ttl_seconds, db_path="", db_max_entries=0):
+        self.max_entries = max(0, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.db_max_entries = max(1, db_max_entries)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        self._db_puts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        if db_path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+                self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS responses "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+                )
+            except (OSError, sqlite3.Error) as err:
+                print(f"[nim-claude-proxy] response cache db disabled ({db_path}): {err}", flush=True)
+                self._db = None
+                self.db_path = ""
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self._db is not None
+
+    def _remember(self, key, entry, expires_at):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (expires_at, entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _db_get(self, key, now):
+        try:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, 0
+            if row[1] + self.ttl_seconds <= now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None, 0
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            return json.loads(row[0]), row[1]
+        except (sqlite3.Error, ValueError) as err:
+            print(f"[nim-claude-proxy] response cache db read failed: {err}", flush=True)
+            return None, 0
+
+    def _db_put(self, key, entry, now):
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(entry, ensure_ascii=False), now, now),
+            )
+            self._db_puts += 1
+            if self._db_puts % 64 == 1:
+                # Trim in batches: expired rows first, then least recently used beyond the limit.
+                expired = self._db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl_seconds,))
+                trimmed = self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.db_max_entries,),
+                )
+                self.evictions += max(0, expired.rowcount) + max(0, trimmed.rowcount)
+        except sqlite3.Error as err:
+            print(f"[nim-claude-proxy] response cache db write failed: {err}", flush=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                if item[0] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return item[1]
+                del self._memory[key]
+            if self._db is not None:
+                entry, created = self._db_get(key, now)
+                if entry is not None:
+                    self._remember(key, entry, created + self.ttl_seconds)
+                    self.disk_hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, key, entry):
+        now = time.time()
+        with self._lock:
+            self._remember(key, entry, now + self.ttl_seconds)
+            if self._db is not None:
+                self._db_put(key, entry, now)
+            self.stores += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "db_path": self.db_path or None,
+                "hits": self.memory_hits + self.disk_hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+_RESPONSE_CACHE = _ResponseCache(
+    CACHE_MAX_ENTRIES if CACHE_ENABLED else 0,
+    CACHE_TTL_SECONDS,
+    CACHE_DB_PATH if CACHE_ENABLED else "",
+    CACHE_DB_MAX_ENTRIES,
+)
+
+
+def _payload_digest(nim_payload, mode=""):
+    material = {name: nim_payload.get(name) for name in ("model", "messages", "max_tokens", "temperature", "top_p")}
+    if mode:
+        material["mode"] = mode
+    return hashlib.sha256(json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _is_deterministic(nim_payload):
+    # Only greedy decoding (temperature 0) repeats itself; sampled requests and requests
+    # that leave temperature to the NIM default are not.
+    temperature = nim_payload.get("temperature")
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)):
+        return False
+    return temperature == 0
+
+
+def _cache_key(nim_payload):
+    if not _RESPONSE_CACHE.enabled or not _is_deterministic(nim_payload):
+        return None
+    return _payload_digest(nim_payload)
+
+
+def _cache_lookup(nim_payload):
+    key = _cache_key(nim_payload)
+    return _RESPONSE_CACHE.get(key) if key else None
+
+
+def _cache_store(nim_payload, text, in_tok, out_tok, stop_reason="end_turn"):
+    # Keyed on the payload actually sent, so a fallback answer is only reused for the
+    # fallback model.
+    key = _cache_key(nim_payload)
+    if key:
+        _RESPONSE_CACHE.put(key, {
+            "model": nim_payload["model"],
+            "text": text,
+            "input_tokens": in_tok,
+            "output_tokens": out_tok,
+            "stop_reason": stop_reason,
+        })
+
+
+def _error_json(msg, err_type="api_error"):
+    return {"type": "error", "error": {"type": err_type, "message": msg}}
+
+
+def _message_json(msg_id, model, text, in_tok, out_tok, stop_reason="end_turn"):
+    return {
+        "id": msg_id,
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": in_tok, "output_tokens": out_tok},
+    }
+
+
+def _health_json(headers, upstream_pool):
+    return {
+        "status": "ok",
+        "timestamp": _utc_iso_now(),
+        "proxy": "nim-claude-proxy",
+        "engine": ENGINE,
+        "port": PORT,
+        "nim_base_url": NIM_BASE_URL,
+        "default_model": PRIMARY_MODEL,
+        "secondary_model": SECONDARY_MODEL,
+        "primary_fallback_model": PRIMARY_FALLBACK_MODEL,
+        "default_display_name": PRIMARY_DISPLAY_NAME,
+        "secondary_display_name": SECONDARY_DISPLAY_NAME,
+        "has_api_key": bool(_nim_api_key(headers)),
+        "upstream_pool": upstream_pool,
+        "response_cache": _RESPONSE_CACHE.stats(),
+        "single_flight": _SINGLE_FLIGHT.stats(),
+    }
+
+
+def _build_nim_payload(body):
+    # Anthropic /v1/messages body -> (model, stream, chat/completions payload).
+    model = _normalize_model(body.get("model"))
+    requested_max_tokens = _safe_int(body.get("max_tokens", 4096), 4096)
+    max_tokens = max(1, min(requested_max_tokens, MAX_OUTPUT_TOKENS))
+    stream = bool(body.get("stream", False))
+
+    nim_payload = {
+        "model": model,
+        "messages": _to_openai_messages(body),
+        "max_tokens": max_tokens,
+        "stream": False,
+    }
+    if "temperature" in body:
+        nim_payload["temperature"] = body["temperature"]
+    if "top_p" in body:
+        nim_payload["top_p"] = body["top_p"]
+
+    print(
+        f"[nim-claude-proxy] request model={model} stream={stream} "
+        f"max_tokens_requested={requested_max_tokens} max_tokens_sent={max_tokens}",
+        flush=True,
+    )
+    return model, stream, nim_payload
+
+
+def _fallback_model(status, model):
+    if status == 0 and model == PRIMARY_MODEL and PRIMARY_FALLBACK_MODEL and PRIMARY_FALLBACK_MODEL != PRIMARY_MODEL:
+        print(
+            f"[nim-claude-proxy] primary model unavailable, falling back to {PRIMARY_FALLBACK_MODEL}",
+            flush=True,
+        )
+        return PRIMARY_FALLBACK_MODEL
+    return None
+
+
+def _parse_completion(nim_body):
+    # Raises ValueError when NIM did not return JSON.
+    nim_json = json.loads(nim_body.decode("utf-8"))
+    text = _extract_nim_text(nim_json)
+    usage = nim_json.get("usage") if isinstance(nim_json, dict) and isinstance(nim_json.get("usage"), dict) else {}
+    return text, _safe_int(usage.get("prompt_tokens", 0), 0), _safe_int(usage.get("completion_tokens", 0), 0)
+
+
+def _log_response(started, in_tok, out_tok, streamed=False, first_token_ms=None):
+    elapsed_ms = int((time.time() - started) * 1000)
+    if streamed:
+        print(
+            f"[nim-claude-proxy] response status=200 stream=upstream elapsed_ms={elapsed_ms} "
+            f"first_token_ms={first_token_ms} input_tokens={in_tok} output_tokens={out_tok}",
+            flush=True,
+        )
+        return
+    print(
+        f"[nim-claude-proxy] response status=200 elapsed_ms={elapsed_ms} "
+        f"input_tokens={in_tok} output_tokens={out_tok}",
+        flush=True,
+    )
+
+
+class _Flight:
+    # One upstream call shared by identical concurrent requests (single-flight). The
+    # producer records the response head, each upstream chunk and the outcome; every
+    # client replays them from the start, so a late joiner still gets the whole answer.
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.listeners = 0
+        self.started = False
+        self.status = 0
+        self.body = b""
+        self.model = None
+        self.chunks = []
+        self.done = False
+        self.error = None
+
+    def _changed(self):
+        self._cond.notify_all()
+
+    def start(self, status, body, model):
+        with self._cond:
+            self.status, self.body, self.model = status, body, model
+            self.started = True
+            self._changed()
+
+    def push(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._changed()
+
+    def finish(self, error=None):
+        # A flight finished without start() reads as status 0 (upstream unreachable).
+        with self._cond:
+            self.error = error
+            self.started = self.done = True
+            self._changed()
+
+    def wait_start(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.started)
+            return self.status, self.body, self.model
+
+    def follow(self):
+        index = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: index < len(self.chunks) or self.done)
+                chunks = self.chunks[index:]
+                done = self.done
+            index += len(chunks)
+            yield from chunks
+            if done:
+                break
+        if self.error:
+            raise ConnectionError(self.error)
+
+
+class _AsyncFlight(_Flight):
+    # _Flight for the asyncio engine: the same record, awaited through an event that is
+    # replaced on every change.
+
+    def __init__(self):
+        super().__init__()
+        self._event = asyncio.Event()
+        self.producer = None
+
+    def _changed(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def wait_start(self):
+        while not self.started:
+            await self._event.wait()
+        return self.status, self.body, self.model
+
+    async def follow(self):
+        index = 0
+        while index < len(self.chunks) or not self.done:
+            if index < len(self.chunks):
+                index += 1
+                yield self.chunks[index - 1]
+            else:
+                await self._event.wait()
+        if self.error:
+            raise ConnectionError(self.error)
+
+
+class _SingleFlight:
+    # In-flight upstream calls by payload key. A request whose key is already in flight
+    # follows that call instead of making its own; key None gets a private flight.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    def join(self, key, flight_type):
+        with self._lock:
+            flight = self._flights.get(key) if key else None
+            leader = flight is None
+            if leader:
+                flight = flight_type()
+                if key:
+                    self._flights[key] = flight
+                self.upstream_calls += 1
+            else:
+                self.coalesced += 1
+            flight.listeners += 1
+        if not leader:
+            print("[nim-claude-proxy] joined an identical in-flight request", flush=True)
+        return flight, leader
+
+    def release(self, flight):
+        with self._lock:
+            flight.listeners -= 1
+
+    def _forget(self, key, flight):
+        if key and self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def abandon_if_idle(self, key, flight):
+        # True once every client has left; the flight is then closed to new joiners.
+        with self._lock:
+            if flight.listeners > 0:
+                return False
+            self._forget(key, flight)
+            return True
+
+    def done(self, key, flight):
+        with self._lock:
+            self._forget(key, flight)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": COALESCE,
+                "sampled": COALESCE and COALESCE_SAMPLED,
+                "in_flight": len(self._flights),
+                "upstream_calls": self.upstream_calls,
+                "coalesced": self.coalesced,
+            }
+
+
+_SINGLE_FLIGHT = _SingleFlight()
+
+
+def _flight_key(nim_payload, mode):
+    # Sampled requests would all receive one sample, so they only share a call when opted in.
+    if not COALESCE or not (COALESCE_SAMPLED or _is_deterministic(nim_payload)):
+        return None
+    return _payload_digest(nim_payload, mode)
+
+
+def _nim_completion(api_key, model, nim_payload):
+    status, nim_body, _ = _nim_request("chat/completions", api_key, nim_payload)
+    fallback = _fallback_model(status, model)
+    if fallback:
+        nim_payload["model"] = model = fallback
+        status, nim_body, _ = _nim_request("chat/completions", api_key, nim_payload)
+    return status, nim_body, model
+
+
+def _shared_completion(api_key, model, nim_payload):
+    # Buffered completion through single-flight. Returns (status, body, model, shared);
+    # shared results were fetched (and cached) by another request.
+    key = _flight_key(nim_payload, "buffered")
+    flight, leader = _SINGLE_FLIGHT.join(key, _Flight)
+    if not leader:
+        return (*flight.wait_start(), True)
+    try:
+        status, nim_body, model = _nim_completion(api_key, model, nim_payload)
+        flight.start(status, nim_body, model)
+        return status, nim_body, model, False
+    finally:
+        _SINGLE_FLIGHT.done(key, flight)
+        flight.finish()
+
+
+def _produce_stream(key, flight, api_key, model, nim_payload):
+    # Reads one upstream stream into flight on its own thread, apart from any client, so
+    # a client that disconnects does not cut off the others following the same flight.
+    stats = {}
+    completed = False
+    error = None
+    upstream = None
+    try:
+        status, body, _ = _nim_open_stream("chat/completions", api_key, nim_payload)
+        fallback = _fallback_model(status, model)
+        if fallback:
+            nim_payload["model"] = model = fallback
+            status, body, _ = _nim_open_stream("chat/completions", api_key, nim_payload)
+        if status == 0 or status >= 400:
+            flight.start(status, body, model)
+            return
+
+        upstream = body
+        flight.start(status, None, model)
+        translator = _StreamTranslator(None, model, stats)
+        for chunk in _iter_sse_json(upstream):
+            translator.feed(chunk)
+            flight.push(chunk)
+            if _SINGLE_FLIGHT.abandon_if_idle(key, flight):
+                error = "Stream abandoned by all clients."
+                return
+        translator.finish()
+        _cache_store(
+            nim_payload, stats.get("text", ""), stats.get("input_tokens", 0), stats.get("output_tokens", 0),
+            stats["stop_reason"],
+        )
+        completed = True
+    except (http.client.HTTPException, OSError, ValueError) as err:
+        # e.g. IncompleteRead from a truncated chunked body.
+        error = str(err) or type(err).__name__
+    finally:
+        if upstream is not None:
+            upstream.close(drain=completed)
+        if not completed and error is None:
+            # Never let followers close a cut-off stream as if it had ended normally.
+            error = "Upstream stream ended unexpectedly."
+        _SINGLE_FLIGHT.done(key, flight)
+        flight.finish(error)
+
+
+def _log_cache_hit(started, cached):
+    elapsed_ms = int((time.time() - started) * 1000)
+    print(
+        f"[nim-claude-proxy] response status=200 cache=hit elapsed_ms={elapsed_ms} "
+        f"input_tokens={cached['input_tokens']} output_tokens={cached['output_tokens']}",
+        flush=True,
+    )
+
+
 class Handler(BaseHTTPRequestHandler):
     server_version = "nim-claude-proxy/1.0"
 
@@ -278,30 +1346,86 @@ class Handler(BaseHTTPRequestHandler):
             return None
 
     def _send_error(self, status, msg, err_type="api_error"):
-        self._send_json(status, {"type": "error", "error": {"type": err_type, "message": msg}})
+        self._send_json(status, _error_json(msg, err_type))
 
     def _sse_event(self, event_name, payload):
-        data = json.dumps(payload, ensure_ascii=False)
-        self.wfile.write(f"event: {event_name}\n".encode("utf-8"))
-        self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+        self.wfile.write(_sse_bytes(event_name, payload))
+        self.wfile.flush()
+
+    def _start_sse(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+    def _finish_sse(self):
+        # Anthropic SDK clients may wait for stream EOF even after message_stop.
+        # Explicitly close the socket so streaming callers terminate promptly.
         self.wfile.flush()
+        self.close_connection = True
+
+    def _stream_from_nim(self, api_key, model, nim_payload, started):
+        nim_payload = dict(nim_payload, stream=True, stream_options={"include_usage": True})
+        key = _flight_key(nim_payload, "stream")
+        flight, leader = _SINGLE_FLIGHT.join(key, _Flight)
+        if leader:
+            threading.Thread(
+                target=_produce_stream, args=(key, flight, api_key, model, nim_payload), daemon=True
+            ).start()
+        try:
+            self._follow_stream(flight, started)
+        finally:
+            _SINGLE_FLIGHT.release(flight)
+
+    def _follow_stream(self, flight, started):
+        status, body, model = flight.wait_start()
+        if status == 0:
+            self._send_error(502, "Unable to reach NVIDIA NIM API.")
+            return
+        if status >= 400:
+            self._send_error(status, _nim_error_message(body))
+            return
+
+        msg_id = f"msg_{uuid.uuid4().hex}"
+        stats = {}
+        first_token_ms = None
+        self._start_sse()
+        try:
+            for event_name, payload in _translate_nim_stream(flight.follow(), msg_id, model, stats):
+                if first_token_ms is None and event_name == "content_block_delta":
+                    first_token_ms = int((time.time() - started) * 1000)
+                self._sse_event(event_name, payload)
+        except (OSError, ValueError) as err:
+            # Headers are already out, so report upstream failures in-band.
+            print(f"[nim-claude-proxy] stream aborted: {err}", flush=True)
+            try:
+                self._sse_event("error", _error_json(str(err)))
+            except OSError:
+                pass
+
+        _log_response(started, stats.get("input_tokens", 0), stats.get("output_tokens", 0), True, first_token_ms)
+        self._finish_sse()
+
+    def _send_cached(self, cached, stream, started):
+        msg_id = f"msg_{uuid.uuid4().hex}"
+        _log_cache_hit(started, cached)
+        response = (
+            msg_id, cached["model"], cached["text"], cached["input_tokens"], cached["output_tokens"],
+            cached["stop_reason"],
+        )
+        if stream:
+            self._start_sse()
+            for event_name, payload in _text_events(*response):
+                self._sse_event(event_name, payload)
+            self._finish_sse()
+            return
+        self._send_json(200, _message_json(*response))
 
     def do_GET(self):
         path = urlparse(self.path).path
         if path == "/health":
-            self._send_json(200, {
-                "status": "ok",
-                "timestamp": _utc_iso_now(),
-                "proxy": "nim-claude-proxy",
-                "port": PORT,
-                "nim_base_url": NIM_BASE_URL,
-                "default_model": PRIMARY_MODEL,
-                "secondary_model": SECONDARY_MODEL,
-                "primary_fallback_model": PRIMARY_FALLBACK_MODEL,
-                "default_display_name": PRIMARY_DISPLAY_NAME,
-                "secondary_display_name": SECONDARY_DISPLAY_NAME,
-                "has_api_key": bool(_nim_api_key(self.headers)),
-            })
+            self._send_json(200, _health_json(self.headers, _UPSTREAM_POOL.stats()))
             return
 
         if path == "/v1/models":
@@ -327,130 +1451,420 @@ class Handler(BaseHTTPRequestHandler):
             return
 
         started = time.time()
-        model = _normalize_model(body.get("model"))
-        requested_max_tokens = _safe_int(body.get("max_tokens", 4096), 4096)
-        max_tokens = max(1, min(requested_max_tokens, MAX_OUTPUT_TOKENS))
-        stream = bool(body.get("stream", False))
+        model, stream, nim_payload = _build_nim_payload(body)
+        cached = _cache_lookup(nim_payload)
+        if cached is not None:
+            self._send_cached(cached, stream, started)
+            return
 
-        nim_payload = {
-            "model": model,
-            "messages": _to_openai_messages(body),
-            "max_tokens": max_tokens,
-            "stream": False,
-        }
-        if "temperature" in body:
-            nim_payload["temperature"] = body["temperature"]
-        if "top_p" in body:
-            nim_payload["top_p"] = body["top_p"]
+        if stream and STREAM_UPSTREAM:
+            self._stream_from_nim(api_key, model, nim_payload, started)
+            return
 
-        print(
-            f"[nim-claude-proxy] request model={model} stream={stream} "
-            f"max_tokens_requested={requested_max_tokens} max_tokens_sent={max_tokens}",
-            flush=True,
+        status, nim_body, model, shared = _shared_completion(api_key, model, nim_payload)
+
+        if status == 0:
+            self._send_error(502, "Unable to reach NVIDIA NIM API.")
+            return
+        if status >= 400:
+            self._send_error(status, _nim_error_message(nim_body))
+            return
+
+        try:
+            text, in_tok, out_tok = _parse_completion(nim_body)
+        except ValueError:
+            self._send_error(502, "NVIDIA NIM API returned non-JSON response.")
+            return
+
+        if not shared:
+            _cache_store(nim_payload, text, in_tok, out_tok)
+        msg_id = f"msg_{uuid.uuid4().hex}"
+        _log_response(started, in_tok, out_tok)
+
+        if stream:
+            self._start_sse()
+            for event_name, payload in _text_events(msg_id, model, text, in_tok, out_tok):
+                self._sse_event(event_name, payload)
+            self._finish_sse()
+            return
+
+        self._send_json(200, _message_json(msg_id, model, text, in_tok, out_tok))
+
+
+async def _cache_call(fn, *args):
+    # The SQLite tier does file I/O, which must not stall the event loop.
+    if _RESPONSE_CACHE.db_path:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+async def _async_nim_completion(api_key, model, nim_payload):
+    status, nim_body, _ = await _async_nim_request("chat/completions", api_key, nim_payload)
+    fallback = _fallback_model(status, model)
+    if fallback:
+        nim_payload["model"] = model = fallback
+        status, nim_body, _ = await _async_nim_request("chat/completions", api_key, nim_payload)
+    return status, nim_body, model
+
+
+async def _async_shared_completion(api_key, model, nim_payload):
+    key = _flight_key(nim_payload, "buffered")
+    flight, leader = _SINGLE_FLIGHT.join(key, _AsyncFlight)
+    if not leader:
+        return (*await flight.wait_start(), True)
+    try:
+        status, nim_body, model = await _async_nim_completion(api_key, model, nim_payload)
+        flight.start(status, nim_body, model)
+        return status, nim_body, model, False
+    finally:
+        _SINGLE_FLIGHT.done(key, flight)
+        flight.finish()
+
+
+async def _async_produce_stream(key, flight, api_key, model, nim_payload):
+    # asyncio version of _produce_stream, run as its own task.
+    stats = {}
+    completed = False
+    error = None
+    upstream = None
+    try:
+        status, body, _ = await _async_nim_open_stream("chat/completions", api_key, nim_payload)
+        fallback = _fallback_model(status, model)
+        if fallback:
+            nim_payload["model"] = model = fallback
+            status, body, _ = await _async_nim_open_stream("chat/completions", api_key, nim_payload)
+        if status == 0 or status >= 400:
+            flight.start(status, body, model)
+            return
+
+        upstream = body
+        flight.start(status, None, model)
+        translator = _StreamTranslator(None, model, stats)
+        async for raw in upstream.lines():
+            chunk = _parse_sse_line(raw)
+            if chunk is _SSE_DONE:
+                break
+            if chunk is None:
+                continue
+            translator.feed(chunk)
+            flight.push(chunk)
+            if _SINGLE_FLIGHT.abandon_if_idle(key, flight):
+                error = "Stream abandoned by all clients."
+                return
+        translator.finish()
+        await _cache_call(
+            _cache_store, nim_payload, stats.get("text", ""), stats.get("input_tokens", 0),
+            stats.get("output_tokens", 0), stats["stop_reason"],
         )
+        completed = True
+    except _ASYNC_UPSTREAM_ERRORS as err:
+        error = str(err) or type(err).__name__
+    finally:
+        if upstream is not None:
+            await upstream.close(drain=completed)
+        if not completed and error is None:
+            error = "Upstream stream ended unexpectedly."
+        _SINGLE_FLIGHT.done(key, flight)
+        flight.finish(error)
+
+
+class _AsyncHandler:
+    # One client connection in the asyncio engine. Same routes, translation and logs as
+    # Handler; every write is awaited (drain), so a slow client holds back its own
+    # stream instead of piling it up in memory. One request per connection, like Handler.
+
+    def __init__(self, server, reader, writer):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.command = ""
+        self.path = ""
+        self.requestline = ""
+        self.headers = {}
+        self.body = b""
+        peer = writer.get_extra_info("peername")
+        self.client_address = peer[0] if peer else "-"
+
+    def log_request(self, status):
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        print(f'[{ts}] {self.client_address} "{self.requestline}" {status} -')
 
-        status, nim_body, _ = _nim_request("chat/completions", api_key, nim_payload)
-        if status == 0 and model == PRIMARY_MODEL and PRIMARY_FALLBACK_MODEL and PRIMARY_FALLBACK_MODEL != PRIMARY_MODEL:
-            fallback_model = PRIMARY_FALLBACK_MODEL
-            print(
-                f"[nim-claude-proxy] primary model unavailable, falling back to {fallback_model}",
-                flush=True,
-            )
-            nim_payload["model"] = fallback_model
-            model = fallback_model
-            status, nim_body, _ = _nim_request("chat/completions", api_key, nim_payload)
+    async def _write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _send_head(self, status, headers):
+        self.log_request(status)
+        phrase = BaseHTTPRequestHandler.responses.get(status, ("",))[0]
+        lines = [f"HTTP/1.1 {status} {phrase}", f"Server: {Handler.server_version}", *headers, "Connection: close"]
+        await self._write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    async def _send_json(self, status, payload):
+        encoded = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await self._send_head(status, ["Content-Type: application/json", f"Content-Length: {len(encoded)}"])
+        await self._write(encoded)
+
+    def _read_json(self):
+        try:
+            parsed = json.loads((self.body or b"{}").decode("utf-8"))
+            return parsed if isinstance(parsed, dict) else {}
+        except ValueError:
+            return None
+
+    async def _send_error(self, status, msg, err_type="api_error"):
+        await self._send_json(status, _error_json(msg, err_type))
+
+    async def _sse_event(self, event_name, payload):
+        await self._write(_sse_bytes(event_name, payload))
+
+    async def _start_sse(self):
+        await self._send_head(200, ["Content-Type: text/event-stream", "Cache-Control: no-cache"])
+
+    async def _read_request(self):
+        line = await asyncio.wait_for(self.reader.readline(), NIM_TIMEOUT_SECONDS)
+        self.requestline = line.decode("latin-1").rstrip("\r\n")
+        parts = self.requestline.split()
+        if len(parts) != 3:
+            if parts:
+                await self._send_json(400, {"error": "bad_request"})
+            return False
+        self.command = parts[0]
+        self.path = urlparse(parts[1]).path
+
+        for _ in range(100):
+            line = await asyncio.wait_for(self.reader.readline(), NIM_TIMEOUT_SECONDS)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            self.headers[name.strip().lower()] = value.strip()
+        else:
+            await self._send_json(431, {"error": "too_many_headers"})
+            return False
+
+        length = _safe_int(self.headers.get("content-length", "0"), 0)
+        if length > 0:
+            self.body = await asyncio.wait_for(self.reader.readexactly(length), NIM_TIMEOUT_SECONDS)
+        return True
+
+    async def handle(self):
+        try:
+            if not await self._read_request():
+                return
+            if self.command == "GET":
+                await self.do_GET()
+            elif self.command == "POST":
+                # The request body is already read, so a slow client never holds a slot.
+                async with self.server.limit:
+                    self.server.active += 1
+                    try:
+                        await self.do_POST()
+                    finally:
+                        self.server.active -= 1
+            else:
+                await self._send_json(501, {"error": "unsupported_method"})
+        except (OSError, EOFError, ValueError, asyncio.TimeoutError):
+            # Client disconnected, timed out or sent a malformed request.
+            pass
+        finally:
+            self.writer.close()
+
+    async def _stream_from_nim(self, api_key, model, nim_payload, started):
+        nim_payload = dict(nim_payload, stream=True, stream_options={"include_usage": True})
+        key = _flight_key(nim_payload, "stream")
+        flight, leader = _SINGLE_FLIGHT.join(key, _AsyncFlight)
+        if leader:
+            flight.producer = asyncio.create_task(_async_produce_stream(key, flight, api_key, model, nim_payload))
+        try:
+            await self._follow_stream(flight, started)
+        finally:
+            _SINGLE_FLIGHT.release(flight)
 
+    async def _follow_stream(self, flight, started):
+        status, body, model = await flight.wait_start()
         if status == 0:
-            self._send_error(502, "Unable to reach NVIDIA NIM API.")
+            await self._send_error(502, "Unable to reach NVIDIA NIM API.")
             return
         if status >= 400:
-            msg = "NVIDIA NIM API request failed."
+            await self._send_error(status, _nim_error_message(body))
+            return
+
+        msg_id = f"msg_{uuid.uuid4().hex}"
+        stats = {}
+        translator = _StreamTranslator(msg_id, model, stats)
+        first_token_ms = None
+
+        async def emit(events):
+            nonlocal first_token_ms
+            for event_name, payload in events:
+                if first_token_ms is None and event_name == "content_block_delta":
+                    first_token_ms = int((time.time() - started) * 1000)
+                await self._sse_event(event_name, payload)
+
+        try:
+            await self._start_sse()
+            await emit(translator.start())
+            async for chunk in flight.follow():
+                await emit(translator.feed(chunk))
+            await emit(translator.finish())
+        except _ASYNC_UPSTREAM_ERRORS as err:
+            # Headers are already out, so report upstream failures in-band.
+            print(f"[nim-claude-proxy] stream aborted: {err}", flush=True)
             try:
-                parsed = json.loads(nim_body.decode("utf-8"))
-                if isinstance(parsed, dict):
-                    err = parsed.get("error")
-                    if isinstance(err, dict) and isinstance(err.get("message"), str):
-                        msg = err["message"]
-            except Exception:
+                await self._sse_event("error", _error_json(str(err)))
+            except OSError:
                 pass
-            self._send_error(status, msg)
+
+        _log_response(started, stats.get("input_tokens", 0), stats.get("output_tokens", 0), True, first_token_ms)
+
+    async def _send_cached(self, cached, stream, started):
+        msg_id = f"msg_{uuid.uuid4().hex}"
+        _log_cache_hit(started, cached)
+        response = (
+            msg_id, cached["model"], cached["text"], cached["input_tokens"], cached["output_tokens"],
+            cached["stop_reason"],
+        )
+        if stream:
+            await self._start_sse()
+            for event_name, payload in _text_events(*response):
+                await self._sse_event(event_name, payload)
+            return
+        await self._send_json(200, _message_json(*response))
+
+    async def do_GET(self):
+        if self.path == "/health":
+            payload = _health_json(self.headers, _ASYNC_UPSTREAM_POOL.stats())
+            payload["concurrency"] = self.server.stats()
+            await self._send_json(200, payload)
+            return
+
+        if self.path == "/v1/models":
+            await self._send_json(200, _model_catalog())
+            return
+
+        await self._send_json(404, {"error": "not_found"})
+
+    async def do_POST(self):
+        if self.path != "/v1/messages":
+            await self._send_json(404, {"error": "not_found"})
+            return
+
+        body = self._read_json()
+        if body is None:
+            await self._send_error(400, "Invalid JSON request body.", "invalid_request_error")
+            return
+
+        api_key = _nim_api_key(self.headers)
+        if not api_key:
+            await self._send_error(
+                401, "Missing NVIDIA API key. Set NIM_API_KEY or NVIDIA_API_KEY.", "authentication_error"
+            )
+            return
+
+        started = time.time()
+        model, stream, nim_payload = _build_nim_payload(body)
+        cached = await _cache_call(_cache_lookup, nim_payload)
+        if cached is not None:
+            await self._send_cached(cached, stream, started)
+            return
+
+        if stream and STREAM_UPSTREAM:
+            await self._stream_from_nim(api_key, model, nim_payload, started)
+            return
+
+        status, nim_body, model, shared = await _async_shared_completion(api_key, model, nim_payload)
+
+        if status == 0:
+            await self._send_error(502, "Unable to reach NVIDIA NIM API.")
+            return
+        if status >= 400:
+            await self._send_error(status, _nim_error_message(nim_body))
             return
 
         try:
-            nim_json = json.loads(nim_body.decode("utf-8"))
-        except json.JSONDecodeError:
-            self._send_error(502, "NVIDIA NIM API returned non-JSON response.")
+            text, in_tok, out_tok = _parse_completion(nim_body)
+        except ValueError:
+            await self._send_error(502, "NVIDIA NIM API returned non-JSON response.")
             return
 
-        text = _extract_nim_text(nim_json)
-        usage = nim_json.get("usage") if isinstance(nim_json.get("usage"), dict) else {}
-        in_tok = _safe_int(usage.get("prompt_tokens", 0), 0)
-        out_tok = _safe_int(usage.get("completion_tokens", 0), 0)
+        if not shared:
+            await _cache_call(_cache_store, nim_payload, text, in_tok, out_tok)
         msg_id = f"msg_{uuid.uuid4().hex}"
-        elapsed_ms = int((time.time() - started) * 1000)
-        print(
-            f"[nim-claude-proxy] response status=200 elapsed_ms={elapsed_ms} "
-            f"input_tokens={in_tok} output_tokens={out_tok}",
-            flush=True,
-        )
+        _log_response(started, in_tok, out_tok)
 
         if stream:
-            self.send_response(200)
-            self.send_header("Content-Type", "text/event-stream")
-            self.send_header("Cache-Control", "no-cache")
-            self.send_header("Connection", "close")
-            self.end_headers()
-
-            self._sse_event("message_start", {
-                "type": "message_start",
-                "message": {
-                    "id": msg_id,
-                    "type": "message",
-                    "role": "assistant",
-                    "model": model,
-                    "content": [],
-                    "stop_reason": None,
-                    "stop_sequence": None,
-                    "usage": {"input_tokens": in_tok, "output_tokens": 0},
-                },
-            })
-            self._sse_event("content_block_start", {
-                "type": "content_block_start",
-                "index": 0,
-                "content_block": {"type": "text", "text": ""},
-            })
-            for chunk in _chunk_text(text):
-                self._sse_event("content_block_delta", {
-                    "type": "content_block_delta",
-                    "index": 0,
-                    "delta": {"type": "text_delta", "text": chunk},
-                })
-            self._sse_event("content_block_stop", {"type": "content_block_stop", "index": 0})
-            self._sse_event("message_delta", {
-                "type": "message_delta",
-                "delta": {"stop_reason": "end_turn", "stop_sequence": None},
-                "usage": {"output_tokens": out_tok},
-            })
-            self._sse_event("message_stop", {"type": "message_stop"})
-            # Anthropic SDK clients may wait for stream EOF even after message_stop.
-            # Explicitly close the socket so streaming callers terminate promptly.
-            self.wfile.flush()
-            self.close_connection = True
-            return
-
-        self._send_json(200, {
-            "id": msg_id,
-            "type": "message",
-            "role": "assistant",
-            "model": model,
-            "content": [{"type": "text", "text": text}],
-            "stop_reason": "end_turn",
-            "stop_sequence": None,
-            "usage": {"input_tokens": in_tok, "output_tokens": out_tok},
-        })
+            await self._start_sse()
+            for event_name, payload in _text_events(msg_id, model, text, in_tok, out_tok):
+                await self._sse_event(event_name, payload)
+            return
+
+        await self._send_json(200, _message_json(msg_id, model, text, in_tok, out_tok))
+
+
+class _AsyncServer:
+    # Single-threaded asyncio engine: every connection is a task, at most MAX_CONCURRENCY
+    # of them talk to NIM at once (the rest wait for a slot), and SIGINT/SIGTERM stop
+    # accepting and give in-flight requests SHUTDOWN_GRACE_SECONDS before cancelling them.
+
+    def __init__(self):
+        self.limit = asyncio.Semaphore(max(1, MAX_CONCURRENCY))
+        self.active = 0
+        self.connections = set()
+
+    def stats(self):
+        return {
+            "connections": len(self.connections),
+            "active": self.active,
+            "max_concurrency": max(1, MAX_CONCURRENCY),
+        }
+
+    async def _on_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            await _AsyncHandler(self, reader, writer).handle()
+        except asyncio.CancelledError:
+            # Cancelled at shutdown once the grace period ran out.
+            pass
+        finally:
+            self.connections.discard(task)
+
+    async def serve(self):
+        server = await asyncio.start_server(self._on_client, "127.0.0.1", PORT, backlog=max(100, MAX_CONCURRENCY))
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stopping.set)
+        print(f"nim-claude-proxy listening on http://127.0.0.1:{PORT} (engine=asyncio)", flush=True)
+
+        await stopping.wait()
+        server.close()
+        pending = set(self.connections)
+        if pending:
+            print(
+                f"[nim-claude-proxy] shutting down, waiting up to {SHUTDOWN_GRACE_SECONDS:g}s "
+                f"for {len(pending)} connection(s)",
+                flush=True,
+            )
+            _, pending = await asyncio.wait(pending, timeout=SHUTDOWN_GRACE_SECONDS)
+            if pending:
+                print(f"[nim-claude-proxy] cancelling {len(pending)} connection(s)", flush=True)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        _ASYNC_UPSTREAM_POOL.close_idle()
+
+
+async def _serve_async():
+    await _AsyncServer().serve()
 
 
 def main():
+    if ENGINE not in ("thread", "asyncio"):
+        raise SystemExit(f"Unknown NIM_PROXY_ENGINE={ENGINE!r}; expected 'thread' or 'asyncio'.")
+    if ENGINE == "asyncio":
+        asyncio.run(_serve_async())
+        return
+
     server = ThreadingHTTPServer(("127.0.0.1", PORT), Handler)
     print(f"nim-claude-proxy listening on http://127.0.0.1:{PORT}", flush=True)
     try:
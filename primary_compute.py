@@ -1,26 +1,75 @@
+import asyncio
+import atexit
+import hashlib
 import json
 import multiprocessing as mp
 import os
+import sqlite3
+import sys
+import tempfile
+import threading
 import time
+import weakref
 from datetime import date
 from pathlib import Path
-from typing import Any
+from typing import Any, AsyncIterator, Callable
 
 import modal
 
+from primary_kernels import KERNELS, _split_ranges, np
+
 APP_NAME = "primary-compute"
 CPU_CORES = float(os.getenv("PRIMARY_MODAL_CPU", "6"))
 MEMORY_MB = int(os.getenv("PRIMARY_MODAL_MEMORY_MB", str(14 * 1024)))
 TIMEOUT_SECONDS = int(os.getenv("PRIMARY_MODAL_TIMEOUT_SECONDS", str(2 * 60 * 60)))
 MAX_MIN_PER_DAY = float(os.getenv("PRIMARY_MODAL_MAX_MIN_PER_DAY", str(3 * 60)))
-STATE_PATH = Path(
+DEFAULT_KERNEL = os.getenv("PRIMARY_KERNEL", "auto")
+DEFAULT_SCHEDULE = os.getenv("PRIMARY_SCHEDULE", "static")
+DEFAULT_OVERSUBSCRIBE = int(os.getenv("PRIMARY_OVERSUBSCRIBE", "8"))
+USAGE_FILE = Path(
     os.getenv(
         "PRIMARY_MODAL_USAGE_FILE",
-        str(Path.home() / ".primary_compute_modal_usage.json"),
+        str(Path.home() / ".primary_compute_modal_usage.sqlite3"),
     )
 )
 
+
+def _is_json_usage_file(path: Path) -> bool:
+    if path.suffix == ".json":
+        return True
+    try:
+        with path.open("rb") as handle:
+            head = handle.read(16)
+    except OSError:
+        return False
+    return bool(head) and not head.startswith(b"SQLite format 3\0")
+
+
+if _is_json_usage_file(USAGE_FILE):
+    # PRIMARY_MODAL_USAGE_FILE still names a pre-ledger JSON usage file: import it
+    # into a sibling .sqlite3 ledger instead of opening the JSON as a database.
+    LEGACY_STATE_PATH = USAGE_FILE
+    STATE_PATH = USAGE_FILE.with_suffix(".sqlite3")
+    if STATE_PATH == USAGE_FILE:
+        STATE_PATH = USAGE_FILE.with_name(USAGE_FILE.name + ".ledger.sqlite3")
+else:
+    LEGACY_STATE_PATH = Path.home() / ".primary_compute_modal_usage.json"
+    STATE_PATH = USAGE_FILE
+
+CACHE_DIR = Path(os.getenv("PRIMARY_CACHE_DIR", str(STATE_PATH.parent / ".primary_compute_cache")))
+CACHE_MAX_ENTRIES = int(os.getenv("PRIMARY_CACHE_MAX_ENTRIES", "1024"))
+CACHE_MODAL_DICT = os.getenv("PRIMARY_CACHE_MODAL_DICT", "")
+DEFAULT_CHECKPOINT = os.getenv("PRIMARY_CHECKPOINT", "0").lower() in {"1", "true", "yes"}
+CHECKPOINT_DIR = Path(
+    os.getenv("PRIMARY_CHECKPOINT_DIR", str(STATE_PATH.parent / ".primary_compute_checkpoints"))
+)
+CHECKPOINT_INTERVAL_S = float(os.getenv("PRIMARY_CHECKPOINT_INTERVAL_S", "30"))
+CHECKPOINT_VOLUME_NAME = os.getenv("PRIMARY_CHECKPOINT_VOLUME", "primary-compute-checkpoints")
+CHECKPOINT_MOUNT = "/checkpoints"
+
 app = modal.App(APP_NAME)
+image = modal.Image.debian_slim().pip_install("numpy").add_local_python_source("primary_kernels")
+checkpoint_volume = modal.Volume.from_name(CHECKPOINT_VOLUME_NAME, create_if_missing=True)
 
 if hasattr(modal, "Resources"):
     FUNCTION_RESOURCES = {"resources": modal.Resources(cpu=CPU_CORES, memory=MEMORY_MB)}
@@ -28,77 +77,390 @@ else:
     FUNCTION_RESOURCES = {"cpu": CPU_CORES, "memory": MEMORY_MB}
 
 
-def _worker_checksum(args: tuple[int, int, int]) -> int:
-    start, count, salt = args
-    acc = 0
-    end = start + count
-    for i in range(start, end):
-        acc = (acc + ((i * i + salt) ^ (i * 2654435761))) & 0xFFFFFFFFFFFFFFFF
-    return acc
+def _resolve_kernel(name: str) -> str:
+    kernel = name.lower().strip()
+    if kernel == "auto":
+        return "numpy" if np is not None else "python"
+    if kernel not in KERNELS:
+        raise ValueError(f"kernel must be one of: auto, {', '.join(sorted(KERNELS))}")
+    if kernel == "numpy" and np is None:
+        raise RuntimeError("kernel=numpy requires numpy. Install it or use kernel=python.")
+    return kernel
+
 
+_POOL: Any = None
+_POOL_WORKERS = 0
 
-def do_heavy_stuff(payload: dict[str, Any]) -> dict[str, Any]:
+
+def _shutdown_pool() -> None:
+    global _POOL, _POOL_WORKERS
+    if _POOL is None:
+        return
+    _POOL.close()
+    _POOL.join()
+    _POOL = None
+    _POOL_WORKERS = 0
+
+
+def _get_pool(workers: int) -> tuple[Any, bool]:
+    global _POOL, _POOL_WORKERS
+    if _POOL is not None and _POOL_WORKERS == workers:
+        return _POOL, True
+
+    _shutdown_pool()
+    _POOL = mp.Pool(processes=workers)
+    _POOL_WORKERS = workers
+    return _POOL, False
+
+
+atexit.register(_shutdown_pool)
+
+
+def _window_segments(
+    ranges: list[tuple[int, int]],
+    window: tuple[int, int] | None,
+) -> list[tuple[int, int, int]]:
+    segments: list[tuple[int, int, int]] = []
+    for part, (start, count) in enumerate(ranges):
+        end = start + count
+        if window is not None:
+            start = max(start, window[0])
+            end = min(end, window[1])
+        if window is None or start < end:
+            segments.append((part, start, end - start))
+    return segments
+
+
+def _chunk_tasks(
+    kernel: str,
+    segments: list[tuple[int, int, int]],
+    salt: int,
+    chunk_size: int,
+) -> list[tuple[str, int, int, int, int]]:
+    tasks: list[tuple[str, int, int, int, int]] = []
+    for part, start, count in segments:
+        end = start + count
+        for offset in range(start, end, chunk_size):
+            tasks.append((kernel, part, offset, min(chunk_size, end - offset), salt))
+    return tasks
+
+
+def _run_task(task: tuple[str, int, int, int, int]) -> tuple[int, int, int, int]:
+    kernel, part, start, count, salt = task
+    return part, start, count, KERNELS[kernel]((start, count, salt))
+
+
+def _load_checkpoint(path: Path) -> dict[tuple[int, int], int]:
+    done: dict[tuple[int, int], int] = {}
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return done
+
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            # A run killed mid-write can leave a torn last line.
+            continue
+        done[(int(entry["start"]), int(entry["count"]))] = int(entry["value"])
+    return done
+
+
+def do_heavy_stuff(
+    payload: dict[str, Any],
+    checkpoint_dir: Path | None = None,
+    on_checkpoint: Callable[[], None] | None = None,
+) -> dict[str, Any]:
     iterations = int(payload.get("iterations", 24_000_000))
     workers = int(payload.get("workers", min(6, os.cpu_count() or 1)))
     workers = max(1, workers)
     salt = int(payload.get("salt", 17))
-
-    base = iterations // workers
-    rem = iterations % workers
-    ranges: list[tuple[int, int, int]] = []
-    offset = 0
-    for idx in range(workers):
-        chunk = base + (1 if idx < rem else 0)
-        ranges.append((offset, chunk, salt))
-        offset += chunk
+    kernel = _resolve_kernel(str(payload.get("kernel", DEFAULT_KERNEL)))
+    worker_fn = KERNELS[kernel]
+    schedule = str(payload.get("schedule", DEFAULT_SCHEDULE)).lower().strip()
+    if schedule not in {"static", "dynamic"}:
+        raise ValueError("schedule must be one of: static, dynamic")
+    checkpoint = str(payload.get("checkpoint", DEFAULT_CHECKPOINT)).lower() in {"1", "true", "yes"}
+    if checkpoint:
+        # Checkpoints are recorded per task, so they need the chunked scheduler.
+        schedule = "dynamic"
+
+    # The checksum is defined over `workers` contiguous ranges: each range is summed
+    # modulo 2**64 and the range sums are XORed together. Dynamic scheduling cuts the
+    # ranges into smaller tasks and adds each task back into its owning range.
+    # A `window` of [lo, hi) restricts the run to those global indices, which is how
+    # sharded runs split one payload across containers; see _merge_shard_results.
+    window = None
+    if payload.get("window") is not None:
+        lo, hi = (int(value) for value in payload["window"])
+        window = (max(0, lo), min(iterations, hi))
+    segments = _window_segments(_split_ranges(iterations, workers), window)
+    extra: dict[str, Any] = {}
 
     started = time.time()
-    if workers == 1:
-        parts = [_worker_checksum(ranges[0])]
+    if schedule == "dynamic":
+        oversubscribe = max(1, int(payload.get("oversubscribe", DEFAULT_OVERSUBSCRIBE)))
+        chunk_size = int(payload.get("chunk_size", 0))
+        if chunk_size <= 0:
+            chunk_size = max(1, -(-iterations // (workers * oversubscribe)))
+        processes = min(workers, os.cpu_count() or 1)
+        tasks = _chunk_tasks(kernel, segments, salt, chunk_size)
+        part_sums = {part: 0 for part, _, _ in segments}
+
+        checkpoint_path = None
+        if checkpoint:
+            checkpoint_path = (checkpoint_dir or CHECKPOINT_DIR) / f"{_payload_key(payload)}.jsonl"
+            done = _load_checkpoint(checkpoint_path)
+            pending = []
+            for task in tasks:
+                _, part, start, count, _ = task
+                if (start, count) in done:
+                    part_sums[part] = (part_sums[part] + done[(start, count)]) & 0xFFFFFFFFFFFFFFFF
+                else:
+                    pending.append(task)
+            extra["resumed_tasks"] = len(tasks) - len(pending)
+            tasks = pending
+
+        if processes == 1:
+            pool_status = "none"
+            results = map(_run_task, tasks)
+        else:
+            pool, warm = _get_pool(processes)
+            pool_status = "warm" if warm else "cold"
+            results = pool.imap_unordered(_run_task, tasks)
+
+        if checkpoint_path is None:
+            for part, _, _, value in results:
+                part_sums[part] = (part_sums[part] + value) & 0xFFFFFFFFFFFFFFFF
+        else:
+            checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+            last_flush = time.time()
+            with checkpoint_path.open("a", encoding="utf-8") as fh:
+                for part, start, count, value in results:
+                    part_sums[part] = (part_sums[part] + value) & 0xFFFFFFFFFFFFFFFF
+                    fh.write(json.dumps({"start": start, "count": count, "value": value}) + "\n")
+                    fh.flush()
+                    if on_checkpoint is not None and time.time() - last_flush >= CHECKPOINT_INTERVAL_S:
+                        on_checkpoint()
+                        last_flush = time.time()
+            checkpoint_path.unlink(missing_ok=True)
+            if on_checkpoint is not None:
+                on_checkpoint()
+        extra.update({"chunk_size": chunk_size, "tasks": len(tasks), "processes": processes})
+    elif len(segments) <= 1:
+        pool_status = "none"
+        part_sums = {part: worker_fn((start, count, salt)) for part, start, count in segments}
     else:
-        with mp.Pool(processes=workers) as pool:
-            parts = pool.map(_worker_checksum, ranges)
+        pool, warm = _get_pool(len(segments))
+        pool_status = "warm" if warm else "cold"
+        values = pool.map(worker_fn, [(start, count, salt) for _, start, count in segments])
+        part_sums = {part: value for (part, _, _), value in zip(segments, values)}
     duration_s = time.time() - started
 
     checksum = 0
-    for value in parts:
+    for value in part_sums.values():
         checksum ^= value
+    if window is not None:
+        extra["window"] = list(window)
+        extra["part_sums"] = sorted(part_sums.items())
 
     return {
         "iterations": iterations,
         "workers": workers,
+        "kernel": kernel,
+        "schedule": schedule,
+        **extra,
         "checksum": checksum,
         "duration_s": round(duration_s, 3),
+        "pool": pool_status,
         "host": os.uname().sysname if hasattr(os, "uname") else os.name,
     }
 
 
-@app.function(timeout=TIMEOUT_SECONDS, **FUNCTION_RESOURCES)
+@app.function(
+    image=image,
+    timeout=TIMEOUT_SECONDS,
+    volumes={CHECKPOINT_MOUNT: checkpoint_volume},
+    **FUNCTION_RESOURCES,
+)
 def heavy_task(payload: dict[str, Any]) -> dict[str, Any]:
-    result = do_heavy_stuff(payload)
+    started = time.time()
+    checkpoint_volume.reload()
+    result = do_heavy_stuff(
+        payload,
+        checkpoint_dir=Path(CHECKPOINT_MOUNT),
+        on_checkpoint=checkpoint_volume.commit,
+    )
     result["execution"] = "modal"
     result["modal_cpu"] = CPU_CORES
     result["modal_memory_mb"] = MEMORY_MB
+    result["container_s"] = round(time.time() - started, 3)
     return result
 
 
-def _read_state() -> dict[str, Any]:
-    today = date.today().isoformat()
-    if not STATE_PATH.exists():
-        return {"day": today, "used_min": 0.0}
+def _ledger() -> sqlite3.Connection:
+    # Append-only run log plus a per-day aggregate, both updated in one transaction,
+    # so budget checks read a single indexed row and parallel callers serialize on
+    # SQLite's write lock instead of racing on a rewritten JSON file.
+    STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    created = not STATE_PATH.exists()
+    conn = sqlite3.connect(STATE_PATH, timeout=30.0, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            day TEXT NOT NULL,
+            payload_hash TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            execution TEXT NOT NULL,
+            cache TEXT NOT NULL,
+            wall_s REAL NOT NULL,
+            modal_min REAL NOT NULL,
+            cpu REAL,
+            memory_mb INTEGER
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS runs_day ON runs (day)")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily (
+            day TEXT PRIMARY KEY,
+            modal_min REAL NOT NULL,
+            runs INTEGER NOT NULL
+        )
+        """
+    )
+    if created:
+        _import_legacy_state(conn)
+    return conn
+
 
+def _import_legacy_state(conn: sqlite3.Connection) -> None:
+    # Carry today's minutes over from the JSON file used before the ledger existed.
+    if STATE_PATH == LEGACY_STATE_PATH or not LEGACY_STATE_PATH.exists():
+        return
     try:
-        data = json.loads(STATE_PATH.read_text(encoding="utf-8"))
+        data = json.loads(LEGACY_STATE_PATH.read_text(encoding="utf-8"))
     except (json.JSONDecodeError, OSError):
-        return {"day": today, "used_min": 0.0}
+        return
+    if data.get("day") != date.today().isoformat():
+        return
 
-    if data.get("day") != today:
-        return {"day": today, "used_min": 0.0}
-    return {"day": today, "used_min": float(data.get("used_min", 0.0))}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 0:
+            used_min = float(data.get("used_min", 0.0))
+            _insert_run(conn, "legacy", "legacy", "legacy", "off", 0.0, used_min, None, None)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _insert_run(
+    conn: sqlite3.Connection,
+    payload_hash: str,
+    mode: str,
+    execution: str,
+    cache: str,
+    wall_s: float,
+    modal_min: float,
+    cpu: float | None,
+    memory_mb: int | None,
+) -> None:
+    today = date.today().isoformat()
+    conn.execute(
+        "INSERT INTO runs (ts, day, payload_hash, mode, execution, cache, wall_s, modal_min, cpu, memory_mb) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (time.time(), today, payload_hash, mode, execution, cache, wall_s, modal_min, cpu, memory_mb),
+    )
+    conn.execute(
+        "INSERT INTO daily (day, modal_min, runs) VALUES (?, ?, 1) "
+        "ON CONFLICT (day) DO UPDATE SET modal_min = modal_min + excluded.modal_min, runs = runs + 1",
+        (today, modal_min),
+    )
 
 
-def _write_state(state: dict[str, Any]) -> None:
-    STATE_PATH.write_text(json.dumps(state, indent=2), encoding="utf-8")
+def _read_state() -> dict[str, Any]:
+    today = date.today().isoformat()
+    conn = _ledger()
+    try:
+        row = conn.execute("SELECT modal_min FROM daily WHERE day = ?", (today,)).fetchone()
+    finally:
+        conn.close()
+    return {"day": today, "used_min": float(row[0]) if row else 0.0}
+
+
+def _record_run(
+    payload: dict[str, Any],
+    mode: str,
+    result: dict[str, Any],
+    wall_s: float,
+    modal_min: float,
+) -> dict[str, Any]:
+    today = date.today().isoformat()
+    conn = _ledger()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _insert_run(
+                conn,
+                _payload_key(payload),
+                mode,
+                str(result.get("execution", "unknown")),
+                str(result.get("cache", "off")),
+                wall_s,
+                modal_min,
+                result.get("modal_cpu", result.get("processes", result.get("workers"))),
+                result.get("modal_memory_mb"),
+            )
+            row = conn.execute("SELECT modal_min FROM daily WHERE day = ?", (today,)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return {"day": today, "used_min": float(row[0])}
+
+
+def _usage_history(days: int, recent_runs: int) -> dict[str, Any]:
+    conn = _ledger()
+    try:
+        daily = conn.execute(
+            "SELECT day, modal_min, runs FROM daily ORDER BY day DESC LIMIT ?",
+            (max(0, days),),
+        ).fetchall()
+        runs = conn.execute(
+            "SELECT ts, payload_hash, mode, execution, cache, wall_s, modal_min, cpu, memory_mb "
+            "FROM runs ORDER BY id DESC LIMIT ?",
+            (max(0, recent_runs),),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    return {
+        "daily": [{"day": day, "used_min": round(used, 3), "runs": count} for day, used, count in daily],
+        "recent_runs": [
+            {
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(ts)),
+                "payload_hash": payload_hash[:12],
+                "mode": mode,
+                "execution": execution,
+                "cache": cache,
+                "wall_s": round(wall_s, 3),
+                "modal_min": round(modal_min, 3),
+                "cpu": cpu,
+                "memory_mb": memory_mb,
+            }
+            for ts, payload_hash, mode, execution, cache, wall_s, modal_min, cpu, memory_mb in runs
+        ],
+    }
 
 
 def should_use_modal(max_min_per_day: float = MAX_MIN_PER_DAY) -> tuple[bool, dict[str, Any]]:
@@ -106,56 +468,335 @@ def should_use_modal(max_min_per_day: float = MAX_MIN_PER_DAY) -> tuple[bool, di
     return state["used_min"] < max_min_per_day, state
 
 
+_LOCAL_POOL_LOCK = threading.Lock()
+
+
 def _run_locally(payload: dict[str, Any]) -> dict[str, Any]:
-    result = do_heavy_stuff(payload)
+    with _LOCAL_POOL_LOCK:
+        result = do_heavy_stuff(payload)
     result["execution"] = "local"
     return result
 
 
+def _normalize_payload(payload: dict[str, Any]) -> dict[str, Any]:
+    # `workers` defines the checksum ranges, so it is pinned before the payload leaves
+    # this process instead of being derived from whichever host runs it.
+    normalized = dict(payload)
+    normalized["iterations"] = int(payload.get("iterations", 24_000_000))
+    normalized["workers"] = max(1, int(payload.get("workers", min(6, max(1, int(CPU_CORES))))))
+    normalized["salt"] = int(payload.get("salt", 17))
+    return normalized
+
+
+def _shard_payloads(payload: dict[str, Any], shards: int) -> list[dict[str, Any]]:
+    payload = _normalize_payload(payload)
+    shard_payloads = []
+    for start, count in _split_ranges(payload["iterations"], shards):
+        if count == 0:
+            continue
+        shard = dict(payload, window=[start, start + count])
+        shard.setdefault("schedule", "dynamic")
+        shard_payloads.append(shard)
+    return shard_payloads
+
+
+def _merge_shard_results(results: list[dict[str, Any]]) -> dict[str, Any]:
+    part_sums: dict[int, int] = {}
+    for result in results:
+        for part, value in result["part_sums"]:
+            part_sums[part] = (part_sums.get(part, 0) + value) & 0xFFFFFFFFFFFFFFFF
+
+    checksum = 0
+    for value in part_sums.values():
+        checksum ^= value
+
+    first = results[0]
+    return {
+        "iterations": first["iterations"],
+        "workers": first["workers"],
+        "kernel": first["kernel"],
+        "schedule": first["schedule"],
+        "checksum": checksum,
+        "duration_s": round(max(result["duration_s"] for result in results), 3),
+        "shards": len(results),
+        "container_s": round(sum(result["container_s"] for result in results), 3),
+        "host": first["host"],
+        "execution": "modal",
+        "modal_cpu": first["modal_cpu"],
+        "modal_memory_mb": first["modal_memory_mb"],
+    }
+
+
+def _payload_key(payload: dict[str, Any]) -> str:
+    # Kernel and scheduling knobs do not change the checksum, so they stay out of the key.
+    normalized = _normalize_payload(payload)
+    identity = {name: normalized[name] for name in ("iterations", "workers", "salt")}
+    if normalized.get("window") is not None:
+        identity["window"] = [int(value) for value in normalized["window"]]
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _cache_modal_dict() -> Any:
+    if not CACHE_MODAL_DICT:
+        return None
+    return modal.Dict.from_name(CACHE_MODAL_DICT, create_if_missing=True)
+
+
+def _cache_get(key: str) -> dict[str, Any] | None:
+    path = CACHE_DIR / f"{key}.json"
+    try:
+        result = json.loads(path.read_text(encoding="utf-8"))
+        os.utime(path)
+        return result
+    except (json.JSONDecodeError, OSError):
+        pass
+
+    remote = _cache_modal_dict()
+    if remote is None:
+        return None
+    result = remote.get(key)
+    if result is not None:
+        _cache_put(key, result, remote=False)
+    return result
+
+
+def _cache_put(key: str, result: dict[str, Any], remote: bool = True) -> None:
+    # Best effort: the result is already computed and charged, so a failed cache write
+    # is reported and otherwise ignored.
+    entry = {
+        name: value
+        for name, value in result.items()
+        if name not in {"cache", "tracked_modal_min_today", "daily_budget_min"}
+    }
+    try:
+        _cache_write_local(key, entry)
+        if remote:
+            remote_dict = _cache_modal_dict()
+            if remote_dict is not None:
+                remote_dict[key] = entry
+    except Exception as err:
+        print(f"primary_compute: result cache write failed: {type(err).__name__}: {err}", file=sys.stderr)
+
+
+def _cache_write_local(key: str, entry: dict[str, Any]) -> None:
+    # Writers in other threads and processes share the directory, so every write gets
+    # its own temp file and files removed by another writer are skipped on eviction.
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(prefix=f".{key}.", suffix=".tmp", dir=CACHE_DIR)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(json.dumps(entry, sort_keys=True))
+        os.replace(tmp_name, CACHE_DIR / f"{key}.json")
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+    entries = []
+    for path in CACHE_DIR.glob("*.json"):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    entries.sort()
+    for _, stale in entries[: max(0, len(entries) - CACHE_MAX_ENTRIES)]:
+        stale.unlink(missing_ok=True)
+
+
+def _run_on_modal(payload: dict[str, Any], shards: int = 1) -> tuple[dict[str, Any], float]:
+    if shards <= 1:
+        start = time.time()
+        result = heavy_task.remote(payload)
+        return result, (time.time() - start) / 60.0
+
+    # Sharded runs bill one container per shard, so charge the summed container time.
+    result = _merge_shard_results(list(heavy_task.map(_shard_payloads(payload, shards))))
+    return result, result["container_s"] / 60.0
+
+
+def _choose_execution(mode: str, max_min_per_day: float, allow_local_fallback: bool) -> str:
+    if mode in {"local", "modal"}:
+        return mode
+
+    use_modal, _ = should_use_modal(max_min_per_day=max_min_per_day)
+    if use_modal:
+        return "modal"
+    if allow_local_fallback:
+        return "local"
+
+    raise RuntimeError(
+        "Modal daily budget reached. Re-run with --allow-local-fallback=1 "
+        "or --mode=modal to force remote."
+    )
+
+
+def _annotate_budget(
+    result: dict[str, Any],
+    mode: str,
+    state: dict[str, Any],
+    max_min_per_day: float,
+) -> dict[str, Any]:
+    if mode == "local":
+        return result
+    result["tracked_modal_min_today"] = round(state["used_min"], 3)
+    if mode == "auto":
+        result["daily_budget_min"] = max_min_per_day
+    return result
+
+
+def _run_uncached(
+    payload: dict[str, Any],
+    mode: str,
+    max_min_per_day: float,
+    allow_local_fallback: bool,
+    shards: int,
+) -> tuple[dict[str, Any], float]:
+    if _choose_execution(mode, max_min_per_day, allow_local_fallback) == "local":
+        return _run_locally(payload), 0.0
+    return _run_on_modal(payload, shards)
+
+
 def run_heavy(
     payload: dict[str, Any],
     max_min_per_day: float = MAX_MIN_PER_DAY,
     allow_local_fallback: bool = False,
     force_mode: str = "auto",
+    shards: int = 1,
+    use_cache: bool = True,
 ) -> dict[str, Any]:
     mode = force_mode.lower().strip()
     if mode not in {"auto", "modal", "local"}:
         raise ValueError("mode must be one of: auto, modal, local")
 
-    if mode == "local":
-        return _run_locally(payload)
-
-    if mode == "modal":
+    started = time.time()
+    payload = _normalize_payload(payload)
+    cache_key = _payload_key(payload)
+    if use_cache:
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            cached["cache"] = "hit"
+            _record_run(payload, mode, cached, time.time() - started, 0.0)
+            return cached
+
+    result, modal_min = _run_uncached(payload, mode, max_min_per_day, allow_local_fallback, shards)
+    if use_cache:
+        result["cache"] = "miss"
+    state = _record_run(payload, mode, result, time.time() - started, modal_min)
+    if use_cache:
+        _cache_put(cache_key, result)
+    return _annotate_budget(result, mode, state, max_min_per_day)
+
+
+async def _run_on_modal_async(payload: dict[str, Any], shards: int = 1) -> tuple[dict[str, Any], float]:
+    if shards <= 1:
         start = time.time()
-        result = heavy_task.remote(payload)
-        elapsed_min = (time.time() - start) / 60.0
-        state = _read_state()
-        state["used_min"] += elapsed_min
-        _write_state(state)
-        result["tracked_modal_min_today"] = round(state["used_min"], 3)
-        return result
+        call = await heavy_task.spawn.aio(payload)
+        result = await call.get.aio()
+        result["job_id"] = call.object_id
+        return result, (time.time() - start) / 60.0
 
-    use_modal, state = should_use_modal(max_min_per_day=max_min_per_day)
-    if use_modal:
-        start = time.time()
-        result = heavy_task.remote(payload)
-        elapsed_min = (time.time() - start) / 60.0
-        state["used_min"] += elapsed_min
-        _write_state(state)
-        result["tracked_modal_min_today"] = round(state["used_min"], 3)
-        result["daily_budget_min"] = max_min_per_day
-        return result
+    results = [result async for result in heavy_task.map.aio(_shard_payloads(payload, shards))]
+    result = _merge_shard_results(results)
+    return result, result["container_s"] / 60.0
 
-    if allow_local_fallback:
-        result = _run_locally(payload)
-        result["tracked_modal_min_today"] = round(state["used_min"], 3)
-        result["daily_budget_min"] = max_min_per_day
-        return result
 
-    raise RuntimeError(
-        "Modal daily budget reached. Re-run with --allow-local-fallback=1 "
-        "or --mode=modal to force remote."
-    )
+# An asyncio.Lock belongs to the loop it was first used on; a driver that calls
+# asyncio.run repeatedly gets a fresh loop each time, so locks are kept per loop.
+_LOCAL_RUN_LOCKS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+async def _run_locally_async(payload: dict[str, Any]) -> dict[str, Any]:
+    # Local runs share one process pool and are CPU bound, so they go one at a time.
+    # The per-loop lock keeps waiting runs from parking to_thread workers; _run_locally
+    # itself also serializes across loops and threads.
+    lock = _LOCAL_RUN_LOCKS.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+    async with lock:
+        return await asyncio.to_thread(_run_locally, payload)
+
+
+async def run_heavy_async(
+    payload: dict[str, Any],
+    max_min_per_day: float = MAX_MIN_PER_DAY,
+    allow_local_fallback: bool = False,
+    force_mode: str = "auto",
+    shards: int = 1,
+    use_cache: bool = True,
+) -> dict[str, Any]:
+    mode = force_mode.lower().strip()
+    if mode not in {"auto", "modal", "local"}:
+        raise ValueError("mode must be one of: auto, modal, local")
+
+    # The ledger, budget check and result cache do blocking file, SQLite and Modal Dict
+    # I/O, so they run in threads to keep other runs on the event loop moving.
+    started = time.time()
+    payload = _normalize_payload(payload)
+    cache_key = _payload_key(payload)
+    if use_cache:
+        cached = await asyncio.to_thread(_cache_get, cache_key)
+        if cached is not None:
+            cached["cache"] = "hit"
+            await asyncio.to_thread(_record_run, payload, mode, cached, time.time() - started, 0.0)
+            return cached
+
+    execution = await asyncio.to_thread(_choose_execution, mode, max_min_per_day, allow_local_fallback)
+    if execution == "local":
+        result, modal_min = await _run_locally_async(payload), 0.0
+    else:
+        result, modal_min = await _run_on_modal_async(payload, shards)
+
+    # Charge the run before touching the cache, so spent minutes always reach the ledger.
+    if use_cache:
+        result["cache"] = "miss"
+    state = await asyncio.to_thread(_record_run, payload, mode, result, time.time() - started, modal_min)
+    if use_cache:
+        await asyncio.to_thread(_cache_put, cache_key, result)
+    return _annotate_budget(result, mode, state, max_min_per_day)
+
+
+async def submit_many(
+    payloads: list[dict[str, Any]],
+    concurrency: int = 8,
+    **kwargs: Any,
+) -> list["asyncio.Task[dict[str, Any]]"]:
+    # Returns one job handle per payload, in payload order, with at most `concurrency`
+    # runs in flight. Failures resolve to {"error": ...} results so one bad payload
+    # does not stop the rest of the batch.
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(payload: dict[str, Any]) -> dict[str, Any]:
+        async with semaphore:
+            try:
+                return await run_heavy_async(payload, **kwargs)
+            except Exception as err:
+                return {"error": f"{type(err).__name__}: {err}"}
+
+    return [
+        asyncio.create_task(run_one(payload), name=f"primary-compute-{index}")
+        for index, payload in enumerate(payloads)
+    ]
+
+
+async def gather_results(jobs: list["asyncio.Task[dict[str, Any]]"]) -> list[dict[str, Any]]:
+    return list(await asyncio.gather(*jobs))
+
+
+async def iter_results(
+    jobs: list["asyncio.Task[dict[str, Any]]"],
+) -> AsyncIterator[tuple[int, dict[str, Any]]]:
+    # Yields (index, result) in completion order; the index is the job's position.
+    indexes = {job: index for index, job in enumerate(jobs)}
+    pending = set(jobs)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for job in sorted(done, key=indexes.__getitem__):
+            yield indexes[job], job.result()
+
+
+async def _run_batch(payloads: list[dict[str, Any]], concurrency: int, **kwargs: Any) -> None:
+    jobs = await submit_many(payloads, concurrency=concurrency, **kwargs)
+    async for index, result in iter_results(jobs):
+        print(json.dumps({"index": index, **result}, sort_keys=True), flush=True)
 
 
 @app.local_entrypoint()
@@ -165,9 +806,34 @@ def main(
     max_min_per_day: float = MAX_MIN_PER_DAY,
     allow_local_fallback: int = 0,
     show_state: int = 0,
+    shards: int = 1,
+    no_cache: int = 0,
+    batch: str = "",
+    concurrency: int = 8,
+    history_days: int = 7,
+    history_runs: int = 10,
 ):
     if show_state:
-        print(json.dumps(_read_state(), indent=2))
+        state = _read_state()
+        state["daily_budget_min"] = max_min_per_day
+        state.update(_usage_history(history_days, history_runs))
+        print(json.dumps(state, indent=2))
+        return
+
+    if batch:
+        lines = Path(batch).read_text(encoding="utf-8").splitlines()
+        payloads = [json.loads(line) for line in lines if line.strip()]
+        asyncio.run(
+            _run_batch(
+                payloads,
+                concurrency,
+                max_min_per_day=max_min_per_day,
+                allow_local_fallback=bool(allow_local_fallback),
+                force_mode=mode,
+                shards=shards,
+                use_cache=not no_cache,
+            )
+        )
         return
 
     payload_obj = json.loads(payload)
@@ -176,5 +842,7 @@ def main(
         max_min_per_day=max_min_per_day,
         allow_local_fallback=bool(allow_local_fallback),
         force_mode=mode,
+        shards=shards,
+        use_cache=not no_cache,
     )
     print(json.dumps(result, indent=2, sort_keys=True))
@@ -0,0 +1,53 @@
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+NUMPY_BLOCK = int(os.getenv("PRIMARY_NUMPY_BLOCK", str(1 << 20)))
+
+
+def _worker_checksum(args: tuple[int, int, int]) -> int:
+    start, count, salt = args
+    acc = 0
+    end = start + count
+    for i in range(start, end):
+        acc = (acc + ((i * i + salt) ^ (i * 2654435761))) & 0xFFFFFFFFFFFFFFFF
+    return acc
+
+
+def _worker_checksum_numpy(args: tuple[int, int, int]) -> int:
+    # uint64 arithmetic wraps modulo 2**64, which matches the masked python loop.
+    start, count, salt = args
+    salt_u64 = np.uint64(salt & 0xFFFFFFFFFFFFFFFF)
+    mult_u64 = np.uint64(2654435761)
+    acc = 0
+    end = start + count
+    for block_start in range(start, end, NUMPY_BLOCK):
+        block_end = min(block_start + NUMPY_BLOCK, end)
+        i = np.arange(block_start, block_end, dtype=np.uint64)
+        terms = i * i
+        terms += salt_u64
+        i *= mult_u64
+        terms ^= i
+        acc = (acc + int(terms.sum(dtype=np.uint64))) & 0xFFFFFFFFFFFFFFFF
+    return acc
+
+
+KERNELS = {
+    "python": _worker_checksum,
+    "numpy": _worker_checksum_numpy,
+}
+
+
+def _split_ranges(iterations: int, workers: int) -> list[tuple[int, int]]:
+    base = iterations // workers
+    rem = iterations % workers
+    ranges: list[tuple[int, int]] = []
+    offset = 0
+    for idx in range(workers):
+        chunk = base + (1 if idx < rem else 0)
+        ranges.append((offset, chunk))
+        offset += chunk
+    return ranges
@@ -112,6 +112,10 @@ if [[ ("$CMD_NAME" == "python" || "$CMD_NAME" == "python3") && "${1:-}" == "-m"
   done
 fi
 
+routing_norm="$(printf '%s' "${MODAL_ROUTING:-0}" | /usr/bin/tr '[:upper:]' '[:lower:]')"
+if [[ "$routing_norm" != "0" && "$routing_norm" != "false" && "$routing_norm" != "no" ]]; then
+  exec "${MODAL_PYTHON_BIN:-/usr/bin/python3}" "${ROOT_DIR}/scripts/modal_router.py" "${CMD_NAME}" "$@"
+fi
 exec "${ROOT_DIR}/scripts/modal_exec.sh" -- "${CMD_NAME}" "$@"
 EOF
   /bin/chmod +x "${SHIMS_DIR}/${cmd}"
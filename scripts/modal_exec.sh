@@ -4,11 +4,16 @@ set -euo pipefail
 usage() {
   /bin/cat <<'EOF'
 Usage:
-  ./scripts/modal_exec.sh [--sync-back|--no-sync-back] -- <command> [args...]
-  ./scripts/modal_exec.sh [--sync-back|--no-sync-back] -c "<shell command>"
+  ./scripts/modal_exec.sh [--sync-back|--no-sync-back] [--session] -- <command> [args...]
+  ./scripts/modal_exec.sh [--sync-back|--no-sync-back] [--session] -c "<shell command>"
+  ./scripts/modal_exec.sh [--sync-back|--no-sync-back] --batch <spec.json> [--max-parallel N]
 
 Runs commands in Modal via modal_tasks.py.
 Default is --sync-back so file changes are written back locally.
+--session (or MODAL_SESSION=1) sends the command to a warm session container
+started on first use (see scripts/modal_session.py).
+--batch runs every command of a JSON spec in one container with one sync-back
+(see the README for the spec format).
 EOF
 }
 
@@ -22,6 +27,9 @@ ROOT_DIR="$(cd "${SCRIPT_DIR}/.." && /bin/pwd)"
 MODAL_PYTHON_BIN="${MODAL_PYTHON_BIN:-/usr/bin/python3}"
 MODAL_RUN_FLAGS="${MODAL_RUN_FLAGS-}"
 SYNC_BACK="${MODAL_SYNC_BACK:-1}"
+SESSION="${MODAL_SESSION:-0}"
+BATCH_SPEC=""
+MAX_PARALLEL=0
 MODAL_CPU="${MODAL_CPU:-6}"
 MODAL_MEMORY_MB="${MODAL_MEMORY_MB:-14336}"
 
@@ -47,13 +55,44 @@ while [[ $# -gt 0 ]]; do
       SYNC_BACK=0
       shift
       ;;
+    --session)
+      SESSION=1
+      shift
+      ;;
+    --batch)
+      if [[ $# -lt 2 ]]; then
+        echo "Error: missing spec file after --batch" >&2
+        exit 2
+      fi
+      BATCH_SPEC="$2"
+      shift 2
+      ;;
+    --max-parallel)
+      if [[ $# -lt 2 ]]; then
+        echo "Error: missing value after --max-parallel" >&2
+        exit 2
+      fi
+      MAX_PARALLEL="$2"
+      shift 2
+      ;;
     *)
       break
       ;;
   esac
 done
 
-if [[ "${1:-}" == "-c" || "${1:-}" == "--cmd" ]]; then
+if [[ -n "$BATCH_SPEC" ]]; then
+  if [[ $# -gt 0 ]]; then
+    echo "Error: --batch takes no command arguments." >&2
+    exit 2
+  fi
+  if [[ ! -f "$BATCH_SPEC" ]]; then
+    echo "Error: batch spec not found: $BATCH_SPEC" >&2
+    exit 2
+  fi
+  BATCH_SPEC="$(cd "$(/usr/bin/dirname "$BATCH_SPEC")" && /bin/pwd)/${BATCH_SPEC##*/}"
+  cmd=""
+elif [[ "${1:-}" == "-c" || "${1:-}" == "--cmd" ]]; then
   shift
   if [[ $# -eq 0 ]]; then
     echo "Error: missing command after -c/--cmd" >&2
@@ -103,11 +142,30 @@ if [[ "$sync_back_norm" == "0" || "$sync_back_norm" == "false" || "$sync_back_no
   sync_flag="--no-sync-back"
 fi
 
+if [[ -n "$BATCH_SPEC" ]]; then
+  batch_cmd=("$MODAL_PYTHON_BIN" -m modal run)
+  if [[ -n "$MODAL_RUN_FLAGS" ]]; then
+    read -r -a run_flag_parts <<< "$MODAL_RUN_FLAGS"
+    batch_cmd+=("${run_flag_parts[@]}")
+  fi
+  batch_cmd+=(modal_tasks.py::batch --spec "$BATCH_SPEC" --max-parallel "$MAX_PARALLEL" "$sync_flag")
+  exec "${batch_cmd[@]}"
+fi
+
+session_norm="$(printf '%s' "$SESSION" | /usr/bin/tr '[:upper:]' '[:lower:]')"
+if [[ "$session_norm" == "1" || "$session_norm" == "true" || "$session_norm" == "yes" ]]; then
+  session_cmd=("$MODAL_PYTHON_BIN" scripts/modal_session.py exec --cmd="$cmd" --workdir="$workdir")
+  if [[ "$sync_flag" == "--no-sync-back" ]]; then
+    session_cmd+=(--no-sync-back)
+  fi
+  exec "${session_cmd[@]}"
+fi
+
 modal_cmd=("$MODAL_PYTHON_BIN" -m modal run)
 if [[ -n "$MODAL_RUN_FLAGS" ]]; then
   read -r -a run_flag_parts <<< "$MODAL_RUN_FLAGS"
   modal_cmd+=("${run_flag_parts[@]}")
 fi
-modal_cmd+=(modal_tasks.py --cmd "$cmd" --workdir "$workdir" "$sync_flag")
+modal_cmd+=(modal_tasks.py::main --cmd "$cmd" --workdir "$workdir" "$sync_flag")
 
 exec "${modal_cmd[@]}"
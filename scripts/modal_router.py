@@ -0,0 +1,218 @@
+import fcntl
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SHIMS_DIR = ROOT_DIR / ".modal-shims"
+STATS_PATH = Path(os.getenv("MODAL_ROUTING_STATS", str(ROOT_DIR / ".caches" / "modal_router_stats.json")))
+EWMA_ALPHA = float(os.getenv("MODAL_ROUTING_EWMA_ALPHA", "0.3"))
+DEFAULT_OVERHEAD_S = float(os.getenv("MODAL_ROUTING_DEFAULT_OVERHEAD_S", "3.0"))
+
+# Filesystem and text utilities finish in milliseconds; a remote round trip never pays
+# off for them. Package managers and build tools are the workloads offload is for.
+LOCAL_COMMANDS = {
+    "basename",
+    "cat",
+    "chmod",
+    "cp",
+    "date",
+    "dirname",
+    "echo",
+    "env",
+    "false",
+    "head",
+    "ln",
+    "ls",
+    "mkdir",
+    "mv",
+    "printf",
+    "pwd",
+    "readlink",
+    "realpath",
+    "rm",
+    "rmdir",
+    "stat",
+    "tail",
+    "tee",
+    "test",
+    "touch",
+    "tr",
+    "true",
+    "wc",
+    "which",
+}
+REMOTE_COMMANDS = {
+    "cargo",
+    "go",
+    "npm",
+    "npx",
+    "pip",
+    "pip3",
+    "pnpm",
+    "pytest",
+    "tsc",
+    "uv",
+    "yarn",
+}
+# Modal-only policy checks (make doctor, make antigravity-policy-check) read the host
+# name and IN_MODAL_TASK_RUNNER; answering them locally would report a false result.
+POLICY_COMMANDS = {"hostname", "uname"}
+POLICY_MARKER = "IN_MODAL_TASK_RUNNER"
+# Commands whose cost depends on the subcommand ("npm test" vs "npm run lint").
+SUBCOMMAND_TOOLS = {"cargo", "go", "node", "npm", "npx", "pnpm", "python", "python3", "uv", "yarn"}
+
+
+def _env_set(name: str) -> set[str]:
+    return {item.strip() for item in os.getenv(name, "").split(",") if item.strip()}
+
+
+def _history_key(cmd: str, args: list[str]) -> str:
+    if cmd in SUBCOMMAND_TOOLS:
+        if cmd.startswith("python") and len(args) >= 2 and args[0] == "-m":
+            return f"{cmd} -m {args[1]}"
+        if args and not args[0].startswith("-"):
+            return f"{cmd} {os.path.basename(args[0])}"
+    return cmd
+
+
+def _load_stats() -> dict[str, Any]:
+    try:
+        return json.loads(STATS_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _offload_overhead_s(stats: dict[str, Any], exclude: str | None = None) -> float:
+    configured = os.getenv("MODAL_ROUTING_OVERHEAD_S")
+    if configured:
+        return float(configured)
+    # The cheapest command ever seen remotely is mostly round-trip cost. A command is
+    # measured against the others only: against its own timing it would always come
+    # out at zero expected work and be kept local after one remote run.
+    remote = [
+        entry["remote"]["ewma_s"]
+        for key, entry in stats.items()
+        if key != exclude and "ewma_s" in entry.get("remote", {})
+    ]
+    return min(remote) if remote else DEFAULT_OVERHEAD_S
+
+
+def _decide(
+    cmd: str, args: list[str], key: str, stats: dict[str, Any], local_path: str | None, in_repo: bool
+) -> tuple[str, str]:
+    if cmd in POLICY_COMMANDS or any(POLICY_MARKER in arg for arg in args):
+        return "remote", "policy check"
+    if not in_repo:
+        return "local", "outside repo"
+    if local_path is None:
+        return "remote", "not installed locally"
+    if cmd in LOCAL_COMMANDS | _env_set("MODAL_ROUTE_LOCAL"):
+        return "local", "rule"
+    if cmd in REMOTE_COMMANDS | _env_set("MODAL_ROUTE_REMOTE"):
+        return "remote", "rule"
+
+    entry = stats.get(key, {})
+    overhead = _offload_overhead_s(stats, exclude=key)
+    if "ewma_s" in entry.get("local", {}):
+        expected = entry["local"]["ewma_s"]
+    elif "ewma_s" in entry.get("remote", {}):
+        expected = max(0.0, entry["remote"]["ewma_s"] - overhead)
+    else:
+        return "remote", "no history"
+    if expected > overhead:
+        return "remote", f"expected {expected:.2f}s > overhead {overhead:.2f}s"
+    return "local", f"expected {expected:.2f}s <= overhead {overhead:.2f}s"
+
+
+def _record(key: str, where: str, elapsed_s: float, code: int) -> None:
+    try:
+        STATS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(STATS_PATH.with_name(f".{STATS_PATH.name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stats = _load_stats()
+            entry = stats.setdefault(key, {}).setdefault(where, {"count": 0, "failures": 0})
+            entry["count"] += 1
+            if code != 0:
+                # A failed run (including a failed offload) says little about runtime.
+                entry["failures"] += 1
+            else:
+                previous = entry.get("ewma_s")
+                entry["ewma_s"] = round(
+                    elapsed_s if previous is None else EWMA_ALPHA * elapsed_s + (1.0 - EWMA_ALPHA) * previous, 4
+                )
+                entry["min_s"] = round(min(entry.get("min_s", elapsed_s), elapsed_s), 4)
+                entry["max_s"] = round(max(entry.get("max_s", elapsed_s), elapsed_s), 4)
+                entry["last_s"] = round(elapsed_s, 4)
+            tmp_path = STATS_PATH.with_name(f".{STATS_PATH.name}.tmp")
+            tmp_path.write_text(json.dumps(stats, indent=2, sort_keys=True), encoding="utf-8")
+            os.replace(tmp_path, STATS_PATH)
+    except OSError:
+        # Stats are advisory; never fail the user's command over them.
+        pass
+
+
+def _print_stats() -> int:
+    stats = _load_stats()
+    print(f"offload overhead estimate: {_offload_overhead_s(stats):.2f}s")
+    print(f"{'command':<32} {'where':<7} {'count':>6} {'ewma_s':>9} {'min_s':>9} {'max_s':>9} {'fail':>5}")
+    for key in sorted(stats):
+        for where, entry in sorted(stats[key].items()):
+            timings = " ".join(
+                f"{entry[field]:>9.3f}" if field in entry else f"{'-':>9}" for field in ("ewma_s", "min_s", "max_s")
+            )
+            print(f"{key:<32} {where:<7} {entry['count']:>6} {timings} {entry['failures']:>5}")
+    return 0
+
+
+def main(argv: list[str]) -> int:
+    if not argv:
+        print("Usage: modal_router.py <command> [args...] | --stats", file=sys.stderr)
+        return 2
+    if argv[0] == "--stats":
+        return _print_stats()
+
+    cmd, args = argv[0], argv[1:]
+    local_env = os.environ.copy()
+    local_env["PATH"] = os.pathsep.join(
+        part for part in local_env.get("PATH", "").split(os.pathsep) if part and Path(part) != SHIMS_DIR
+    )
+    local_path = shutil.which(cmd, path=local_env["PATH"])
+    cwd = Path.cwd().resolve()
+    in_repo = cwd == ROOT_DIR or ROOT_DIR in cwd.parents
+
+    key = _history_key(cmd, args)
+    where, reason = _decide(cmd, args, key, _load_stats(), local_path, in_repo)
+    if os.getenv("MODAL_ROUTING_DEBUG"):
+        print(f"modal_router: {key} -> {where} ({reason})", file=sys.stderr)
+
+    if where == "local":
+        command = [local_path or cmd, *args]
+        env = local_env
+    else:
+        command = [str(ROOT_DIR / "scripts" / "modal_exec.sh"), "--", cmd, *args]
+        env = None
+
+    started = time.perf_counter()
+    try:
+        proc = subprocess.Popen(command, env=env)
+    except OSError as err:
+        print(f"modal_router: {err}", file=sys.stderr)
+        return 127
+    # The child shares our process group, so Ctrl-C reaches it directly; the router
+    # only waits for it and records the timing. SIG_IGN is set after the spawn since
+    # an ignored disposition would be inherited across exec.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    code = proc.wait()
+    _record(key, where, time.perf_counter() - started, code)
+    return 128 - code if code < 0 else code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,205 @@
+import argparse
+import base64
+import fcntl
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+CACHE_DIR = ROOT_DIR / ".caches"
+SOCKET_PATH = Path(os.getenv("MODAL_SESSION_SOCKET", str(CACHE_DIR / "modal-session.sock")))
+LOCK_PATH = CACHE_DIR / "modal-session.lock"
+LOG_PATH = CACHE_DIR / "modal-session.log"
+IDLE_SECONDS = int(os.getenv("MODAL_SESSION_IDLE_SECONDS", "600"))
+START_TIMEOUT_SECONDS = int(os.getenv("MODAL_SESSION_START_TIMEOUT_SECONDS", "120"))
+
+# The client side (exec/start/stop/status) only uses the standard library so a shimmed
+# command costs one small interpreter start; modal and modal_tasks load in the server.
+
+
+def _run_command(modal_tasks: Any, request: dict[str, Any], send: Callable[..., None]) -> int:
+    workdir = modal_tasks._normalize_workdir(request.get("workdir", "."))
+
+    def execute(manifest_digest: str) -> tuple[int, Any]:
+        frames = modal_tasks.session_exec.remote_gen(
+            request["cmd"],
+            workdir,
+            modal_tasks._local_sync_codecs(),
+            manifest_digest,
+            bool(request.get("sync_back", True)),
+        )
+        return modal_tasks._split_command_frames(
+            frames, lambda kind, data: send(**{kind: base64.b64encode(data).decode("ascii")})
+        )
+
+    code, sync_frames = modal_tasks._with_pushed_repo(str(ROOT_DIR), execute, session=True)
+    if sync_frames is not None:
+        synced = modal_tasks._apply_repo_change_stream(str(ROOT_DIR), sync_frames)
+        modal_tasks._record_synced_files(str(ROOT_DIR), synced)
+    return code
+
+
+def _serve() -> int:
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    lock = open(LOCK_PATH, "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print("A session server is already running.", file=sys.stderr)
+        return 0
+
+    sys.path.insert(0, str(ROOT_DIR))
+    os.chdir(ROOT_DIR)
+    import modal
+    import modal_tasks
+
+    state = {"last_used": time.monotonic(), "stopping": False}
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self) -> None:
+            client_open = True
+
+            def send(**message: Any) -> None:
+                nonlocal client_open
+                if not client_open:
+                    return
+                try:
+                    self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                except OSError:
+                    # The client went away (e.g. Ctrl-C); finish the command and its
+                    # sync-back anyway so the local tree stays consistent.
+                    client_open = False
+
+            request = json.loads(self.rfile.readline() or b"{}")
+            op = request.get("op", "exec")
+            if op == "stop":
+                state["stopping"] = True
+            if op != "exec":
+                send(exit=0)
+                return
+
+            try:
+                code = _run_command(modal_tasks, request, send)
+            except Exception as err:
+                send(error=f"{type(err).__name__}: {err}")
+                code = 1
+            send(exit=code)
+            state["last_used"] = time.monotonic()
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with modal.enable_output(), modal_tasks.app.run():
+        if SOCKET_PATH.exists():
+            SOCKET_PATH.unlink()
+        server = socketserver.UnixStreamServer(str(SOCKET_PATH), Handler)
+        server.timeout = 1.0
+        try:
+            while not state["stopping"] and time.monotonic() - state["last_used"] < IDLE_SECONDS:
+                server.handle_request()
+        finally:
+            server.server_close()
+            SOCKET_PATH.unlink(missing_ok=True)
+    return 0
+
+
+def _connect() -> socket.socket | None:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(SOCKET_PATH))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _request(message: dict[str, Any]) -> int | None:
+    sock = _connect()
+    if sock is None:
+        return None
+    with sock, sock.makefile("rb") as replies:
+        sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        code = 1
+        for line in replies:
+            reply = json.loads(line)
+            if "stdout" in reply:
+                sys.stdout.buffer.write(base64.b64decode(reply["stdout"]))
+                sys.stdout.buffer.flush()
+            elif "stderr" in reply:
+                sys.stderr.buffer.write(base64.b64decode(reply["stderr"]))
+                sys.stderr.buffer.flush()
+            elif "error" in reply:
+                print(f"modal session: {reply['error']}", file=sys.stderr)
+            elif "exit" in reply:
+                code = int(reply["exit"])
+        return code
+
+
+def _start() -> None:
+    if _request({"op": "ping"}) is not None:
+        return
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOG_PATH, "ab") as log:
+        proc = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "serve"],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            cwd=ROOT_DIR,
+            start_new_session=True,
+        )
+
+    deadline = time.monotonic() + START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if _request({"op": "ping"}) is not None:
+            return
+        if proc.poll() not in {None, 0}:
+            break
+        time.sleep(0.2)
+    raise SystemExit(f"Modal session server did not start; see {LOG_PATH}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Warm Modal session for modal_exec.sh --session.")
+    sub = parser.add_subparsers(dest="action", required=True)
+    sub.add_parser("serve", help="run the session server in the foreground")
+    sub.add_parser("start", help="start the session server in the background")
+    sub.add_parser("stop", help="stop the session server")
+    sub.add_parser("status", help="report whether the session server is running")
+    exec_parser = sub.add_parser("exec", help="run a command in the session, starting it if needed")
+    exec_parser.add_argument("--cmd", required=True)
+    exec_parser.add_argument("--workdir", default=".")
+    exec_parser.add_argument("--no-sync-back", action="store_true")
+    args = parser.parse_args()
+
+    if args.action == "serve":
+        return _serve()
+    if args.action == "start":
+        _start()
+        return 0
+    if args.action == "stop":
+        if _request({"op": "stop"}) is None:
+            print("No session server running.")
+        return 0
+    if args.action == "status":
+        running = _request({"op": "ping"}) is not None
+        print(f"running ({SOCKET_PATH})" if running else "stopped")
+        return 0 if running else 1
+
+    _start()
+    message = {"op": "exec", "cmd": args.cmd, "workdir": args.workdir, "sync_back": not args.no_sync_back}
+    code = _request(message)
+    if code is None:
+        raise SystemExit("Lost connection to the Modal session server.")
+    return code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,41 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import primary_kernels  # noqa: E402
+
+
+def _random_cases(seed: int, count: int) -> list[tuple[int, int, int]]:
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        start = rng.choice([rng.randrange(0, 1 << 20), rng.randrange(1 << 32, 1 << 40)])
+        stop = start + rng.randrange(0, 5000)
+        salt = rng.randrange(-(1 << 64), 1 << 64)
+        cases.append((start, stop, salt))
+    return cases
+
+
+@pytest.mark.parametrize("start,stop,salt", _random_cases(seed=2024, count=200))
+def test_numpy_kernel_matches_python_loop(start: int, stop: int, salt: int) -> None:
+    args = (start, stop - start, salt)
+    assert primary_kernels._worker_checksum_numpy(args) == primary_kernels._worker_checksum(args)
+
+
+def test_numpy_kernel_matches_across_block_boundaries(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(primary_kernels, "NUMPY_BLOCK", 7)
+    for start, stop, salt in _random_cases(seed=7, count=50):
+        args = (start, stop - start, salt)
+        assert primary_kernels._worker_checksum_numpy(args) == primary_kernels._worker_checksum(args)
+
+
+def test_split_ranges_cover_the_iterations_once() -> None:
+    rng = random.Random(11)
+    for _ in range(100):
+        iterations = rng.randrange(0, 10_000)
+        workers = rng.randrange(1, 17)
+        ranges = primary_kernels._split_ranges(iterations, workers)
+        covered = [i for start, count in ranges for i in range(start, start + count)]
+        assert covered == list(range(iterations))